@@ -0,0 +1,56 @@
+#!/usr/bin/env python2.6
+
+from blocked_sketch import *
+import cPickle
+import unittest
+
+
+class BlockedDeprecatingSketchTest(unittest.TestCase):
+    def setUp(self):
+        self.sketch = BlockedDeprecatingSketch(slots=64, items=4, per_item=3, block=16)
+
+    def test_hash_range(self):
+        self.assertEquals(self.sketch.hash_range, 4 * 16 ** 3)
+
+    def test_probes_share_a_block(self):
+        for password in ["abc", "123456", "correct horse", 12345]:
+            blocks = set(h // 16 for h in self.sketch.hashes(password))
+            self.assertEquals(len(blocks), 1)
+
+    def test_hash_values(self):
+        self.assertEquals(list(self.sketch.hashes(2 + 4 * (1 + 16 * (2 + 16 * 3)))),
+                          [33, 34, 35])
+
+    def test_deprecates(self):
+        self.sketch.add("abc")
+        self.assertTrue("abc" in self.sketch)
+        for i in range(4):
+            self.sketch.add(i)
+        self.assertFalse("abc" in self.sketch)
+
+    def test_add_many(self):
+        expected = BlockedDeprecatingSketch(slots=64, items=4, per_item=3, block=16)
+        for i in range(10):
+            expected.add(str(i))
+        self.sketch.add_many(map(str, range(10)))
+        self.assertEquals(self.sketch, expected)
+
+    def test_pickle(self):
+        self.sketch.add("abc")
+        pickle_clone = cPickle.loads(cPickle.dumps(self.sketch))
+        self.assertEquals(pickle_clone.block, 16)
+        self.assertEquals(pickle_clone.hash_range, self.sketch.hash_range)
+        self.assertEquals(pickle_clone, self.sketch)
+
+    def test_parameters_changed(self):
+        self.assertFalse(self.sketch.parameters_changed(slots=64, items=4, per_item=3, block=16))
+        self.assertTrue(self.sketch.parameters_changed(slots=64, items=4, per_item=3, block=8))
+        self.assertTrue(self.sketch.parameters_changed(slots=128, items=4, per_item=3, block=16))
+
+    def test_block_must_divide_slots(self):
+        self.assertRaises(ValueError, BlockedDeprecatingSketch,
+                          slots=60, items=4, per_item=3, block=16)
+
+
+if __name__ == "__main__":
+    unittest.main()
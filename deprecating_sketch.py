@@ -8,11 +8,12 @@ bans passwords that were very common before the skethc was put in
 place.
 """
 
+import collections
 import hashlib
 import math
 import utils 
 import gflags
-import sys
+import threading
 
 GFLAGS = gflags.FLAGS 
 gflags.DEFINE_integer('slots', 2**19, 
@@ -27,9 +28,178 @@ gflags.DEFINE_integer('items', 2**16,
 
 gflags.DEFINE_integer('per_item', 2, 'See slots for discussion')
 
+gflags.DEFINE_enum('counter_bits', '0', ['0', '4', '8'],
+"""Bits of storage per slot.  0 keeps a Python int per slot; 4 and 8
+keep small counters that are several times smaller, with the few slots
+that count higher than that remembered exactly on the side.""")
+
 class TooManyHashBitsRequired(Exception):
     def __init__(self, bits):
-        exception.__init__(self, "%s bits is just too many for this implementation" % bits )
+        Exception.__init__(self, "%s bits is just too many for this implementation" % bits )
+
+def hash_function(hash_range):
+    """Choose the hashlib function used for a sketch's hash_range.
+
+    Clients hashing passwords themselves (see password_oracle_client)
+    must use exactly this function to agree with the server.
+
+    Args:
+      hash_range: slots ** per_item of the sketch.
+
+    Returns:
+      The cheapest hashlib constructor providing enough bits.
+    """
+    required_bits = math.log(hash_range, 2)
+
+    # TODO(deprince): This is a huge potential perforamnce
+    # problem.  Bloomfilters don't need cryptographic quality hash
+    # functions?  Might FNV, even implemented in Python, be
+    # faster?  There is some research that suggests hash bits can
+    # reused for a bloom filter, perhaps hash(s) could be used?
+    # Honestly however, can it be any worse than
+    # HTTPServer.BaseServer?
+
+    if required_bits < 128:
+        return hashlib.md5
+    elif required_bits < 160:
+        return hashlib.sha1 
+    elif required_bits < 224:
+        return hashlib.sha224
+    elif required_bits < 256:
+        return hashlib.sha256
+    elif required_bits < 384:
+        return hashlib.sha384
+    elif required_bits < 512:
+        return hashlib.sha512 
+    raise TooManyHashBitsRequired(required_bits)
+
+
+class SaturatingCounters(object):
+    """A fixed size array of non-negative counters in a few bits each.
+
+    A counter that reaches the largest value its bits can hold is
+    pinned there, and its real value is kept in the overflow dict
+    instead.  Reading and writing are exact whatever the value, so
+    counters[h] += 1 and counters[h] -= 1 behave just as on a list.
+    """
+    __slots__ = ('counters', 'overflow', 'size')
+
+    # The largest value stored in place, set by subclasses.
+    SATURATED = None
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for index in xrange(self.size):
+            yield self[index]
+
+    def saturated(self, index, value):
+        "Keep value in overflow if it's too big, returning what to store."
+        if value >= self.SATURATED:
+            self.overflow[index] = value
+            return self.SATURATED
+        if value < 0:
+            raise ValueError('counters cannot go below zero')
+        self.overflow.pop(index, None)
+        return value
+
+
+class ByteCounters(SaturatingCounters):
+    "SaturatingCounters of 8 bits each."
+    __slots__ = ()
+    SATURATED = 255
+
+    def __init__(self, size):
+        self.counters = bytearray(size)
+        self.overflow = {}
+        self.size = size
+
+    def __getitem__(self, index):
+        value = self.counters[index]
+        if value == 255:
+            return self.overflow[index]
+        return value
+
+    def __setitem__(self, index, value):
+        self.counters[index] = self.saturated(index, value)
+
+
+class NibbleCounters(SaturatingCounters):
+    "SaturatingCounters of 4 bits each, two to a byte."
+    __slots__ = ()
+    SATURATED = 15
+
+    def __init__(self, size):
+        self.counters = bytearray((size + 1) // 2)
+        self.overflow = {}
+        self.size = size
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError('counter index out of range')
+        value = self.counters[index >> 1] >> ((index & 1) << 2) & 15
+        if value == 15:
+            return self.overflow[index]
+        return value
+
+    def __setitem__(self, index, value):
+        if not 0 <= index < self.size:
+            raise IndexError('counter index out of range')
+        value = self.saturated(index, value)
+        shift = (index & 1) << 2
+        byte = index >> 1
+        self.counters[byte] = self.counters[byte] & (0xf0 >> shift) | value << shift
+
+
+def counters(size, bits):
+    """Make size zeroed counters of the given width.
+
+    Args:
+      size: The number of counters.
+      bits: 0 for a list of ints, or 4 or 8 for SaturatingCounters.
+    """
+    if bits == 0:
+        return [0] * size
+    if bits == 4:
+        return NibbleCounters(size)
+    if bits == 8:
+        return ByteCounters(size)
+    raise ValueError('%r bit counters are not supported' % bits)
+
+
+class PeerDeltas(object):
+    """The deltas merged into a sketch from one peer, oldest first.
+
+    total is the number of slot increments they add up to.
+    """
+
+    def __init__(self):
+        self.deltas = collections.deque()
+        self.total = 0
+
+
+def hashes(s, hashfunc, slots, per_item):
+    """Generate the slots a string or hash value maps to.
+
+    Args:
+      s: A string to hash, or an integer that is already a hash value.
+      hashfunc: The hashlib function chosen by hash_function.
+      slots: The number of slots in the sketch.
+      per_item: The number of slots to generate.
+
+    Yields:
+      per_item values in Z_slots.
+    """
+    try:
+        s + 1 
+        h = s
+    except TypeError:
+        h = int(hashfunc(s).hexdigest(), 16)
+    for x in range(per_item):
+        yield h % slots
+        h = h // slots
+
 
 class DeprecatingSketch(utils.Identity):
 
@@ -46,8 +216,23 @@ class DeprecatingSketch(utils.Identity):
     additions ago will be removed.
     
     This data structure will never generate a false negative.  
+
+    add and __contains__ hold self.lock, so a sketch may be shared by
+    several serving threads.  Take the lock yourself to make a
+    sequence of calls atomic.
+
+    Sketches in different places can share what they've seen: each
+    periodically hands its peers export_delta(), the slot increments
+    of its own recent adds, and they merge() it.  Merged increments
+    count towards membership like local ones and expire once the peer
+    has sent another ring buffer's worth after them (see
+    sketch_sync.py.)
     """
-    def __init__(self, slots=GFLAGS.slots, items=GFLAGS.items, per_item=GFLAGS.per_item):
+    # The constructor arguments parameters_changed compares.
+    parameters = ('slots', 'items', 'per_item')
+
+    def __init__(self, slots=GFLAGS.slots, items=GFLAGS.items, per_item=GFLAGS.per_item,
+                 counter_bits=0):
         """Create a deprecating sketch
         
         Args:
@@ -61,41 +246,30 @@ class DeprecatingSketch(utils.Identity):
           specifies how "temporary" the membership is.
 
           per_item: The number of bits to set per_item.   Deep voodoo here.
+
+          counter_bits: How slots are stored, see counters().  This
+          changes memory use, never results.
         """
           
-        self.__slots = [0] * slots 
+        self.counter_bits = counter_bits
+        self.__slots = counters(slots, counter_bits)
+        self.slotlen = slots
         self.__que = [None] * items * per_item 
         self.__queoffset = 0 
+        self.__unexported = 0
+        self.peers = {}
         self.__per_item = per_item
+        self.lock = threading.RLock()
         self.choose_hash_function()
 
+    @property
+    def per_item(self):
+        return self.__per_item
+
     def choose_hash_function(self):
         """Assign to self.hashfunc a hashlib function that provides enough bits."""
-        required_bits = math.log(len(self.__slots), 2 ) * self.__per_item
         self.hash_range = len(self.__slots) ** self.__per_item
-
-        # TODO(deprince): This is a huge potential perforamnce
-        # problem.  Bloomfilters don't need cryptographic quality hash
-        # functions?  Might FNV, even implemented in Python, be
-        # faster?  There is some research that suggests hash bits can
-        # reused for a bloom filter, perhaps hash(s) could be used?
-        # Honestly however, can it be any worse than
-        # HTTPServer.BaseServer?
-
-        if required_bits < 128:
-            self.hashfunc = hashlib.md5
-        elif required_bits < 160:
-            self.hashfunc = hashlib.sha1 
-        elif required_bits < 224:
-            self.hashfunc = hashlib.sha224
-        elif required_bits < 256:
-            self.hashfunc = hashlib.sha256
-        elif required_bits < 384:
-            self.hashfunc = hashlib.sha384
-        elif required_bits < 512:
-            self.hash_func = hashlib.sha512 
-        else:
-            raise TooManyHashBitsRequired(required_bits)
+        self.hashfunc = hash_function(self.hash_range)
             
     def hashes(self, s):
         """Generate hashes for a string.
@@ -106,14 +280,7 @@ class DeprecatingSketch(utils.Identity):
         Returns:
           An array per_item (see constructor) in length with hash values in Z_slots.
         """
-        try:
-            s + 1 
-            h = s
-        except TypeError:
-            h = int(self.hashfunc(s).hexdigest(), 16)
-        for x in range(self.__per_item):
-            yield h % len(self.__slots)
-            h = h // len(self.__slots)
+        return hashes(s, self.hashfunc, len(self.__slots), self.__per_item)
 
     def add_hash(self, h):
         """Add to the bloomfilter a hash value.  
@@ -125,12 +292,88 @@ class DeprecatingSketch(utils.Identity):
         self.__que[self.__queoffset] = h
         self.__slots[h] += 1 
         self.__queoffset = (self.__queoffset + 1) % len(self.__que) 
+        self.__unexported += 1
 
     def add(self, s):
         """Add a string to the deprecating_sketch.  
 
         The oldest string is removed at the same time."""
-        map(self.add_hash, self.hashes(s))
+        with self.lock:
+            map(self.add_hash, self.hashes(s))
+
+    def add_hashes(self, offsets, skipped=0):
+        """Add a list of slot offsets, exactly as map(add_hash, offsets) would.
+
+        Once offsets is at least as long as the ring buffer, only its
+        tail survives, so the ring and slots are rebuilt from the tail
+        in one pass instead of being decremented and incremented once
+        per offset.
+
+        Args:
+          offsets: Slot offsets, oldest first, i.e. from hashes.
+          skipped: The number of offsets that preceded these and were
+            left out because they'd have been pushed out of the ring
+            anyway.  Only allowed if offsets fills the ring.
+        """
+        ring = len(self.__que)
+        with self.lock:
+            if len(offsets) < ring:
+                assert not skipped, "skipped offsets require a full ring"
+                map(self.add_hash, offsets)
+                return
+            total = skipped + len(offsets)
+            # The ring position the oldest surviving offset was written to.
+            first = (self.__queoffset + total - ring) % ring
+            tail = offsets[-ring:]
+            self.__que = tail[ring - first:] + tail[:ring - first]
+            self.__queoffset = (self.__queoffset + total) % ring
+            self.__unexported += total
+            self.count_slots()
+
+    def add_many(self, items):
+        """Add each of items (strings or hash values) in order, as add would.
+
+        Only the last items * per_item slot additions can survive in
+        the ring, so only the items they came from are hashed; the rest
+        are merely counted.  This is what makes replaying a long log
+        of adds (see seed_sketch.py) fast.
+
+        Returns:
+          The number of items added.
+        """
+        tail = collections.deque(maxlen=-(-len(self.__que) // self.__per_item))
+        count = 0
+        for count, item in enumerate(items, 1):
+            tail.append(item)
+        offsets = [offset for item in tail for offset in self.hashes(item)]
+        self.add_hashes(offsets, (count - len(tail)) * self.__per_item)
+        return count
+
+    def claim(self, s):
+        """Add a string (or hash value) unless it is already a member.
+
+        The test and the add happen under one hold of the lock, so two
+        callers can't both claim the same password, and s is hashed
+        only once.
+
+        Returns:
+          True if s was available (and has now been added), False otherwise.
+        """
+        offsets = list(self.hashes(s))
+        with self.lock:
+            if sum(map(self.test_hash, offsets)) != 0:
+                return False
+            map(self.add_hash, offsets)
+            return True
+
+    def claim_many(self, items):
+        """Claim each of items in turn, atomically as a whole.
+
+        Returns:
+          A list with claim's result for each item.
+        """
+        with self.lock:
+            return map(self.claim, items)
 
     def test_hash(self, h):
         """Test a given hash value for membership.
@@ -141,31 +384,111 @@ class DeprecatingSketch(utils.Identity):
         """
         return self.__slots[h]
 
+    @property
+    def ring_size(self):
+        "The number of slot increments the ring buffer holds, items * per_item."
+        return len(self.__que)
+
+    def export_delta(self):
+        """Collect the slot increments of local adds since the last export.
+
+        Adds that have already left the ring buffer are not included,
+        so a delta never holds more than ring_size increments.  Merged
+        increments are never exported, so they don't echo back.
+
+        Returns:
+          A dict mapping slot offset to increment.
+        """
+        delta = {}
+        with self.lock:
+            ring = len(self.__que)
+            count = min(self.__unexported, ring)
+            for position in range(self.__queoffset - count, self.__queoffset):
+                offset = self.__que[position % ring]
+                delta[offset] = delta.get(offset, 0) + 1
+            self.__unexported = 0
+        return delta
+
+    def merge(self, origin, delta):
+        """Add a delta exported by the sketch of peer origin.
+
+        Each peer's merged deltas expire oldest first, as soon as the
+        ones after them add up to at least ring_size increments, so a
+        peer's adds are remembered at least as long as the peer itself
+        remembers them.
+
+        Args:
+          origin: A name identifying the peer.
+          delta: The peer's export_delta().  Its sketch must have the
+            same slots and ring_size as this one.
+
+        Raises:
+          ValueError if delta holds more than ring_size increments,
+          which export_delta never does.
+        """
+        total = sum(delta.itervalues())
+        if not total:
+            return
+        if total > len(self.__que):
+            raise ValueError('delta of %d increments is more than a ring of %d' % 
+                             (total, len(self.__que)))
+        with self.lock:
+            peer = self.peers.setdefault(origin, PeerDeltas())
+            for offset, count in delta.iteritems():
+                self.__slots[offset] += count
+            peer.deltas.append((delta, total))
+            peer.total += total
+            while peer.total - peer.deltas[0][1] >= len(self.__que):
+                expired, expired_total = peer.deltas.popleft()
+                for offset, count in expired.iteritems():
+                    self.__slots[offset] -= count
+                peer.total -= expired_total
+
+    def set_counter_bits(self, counter_bits):
+        "Change how slots are stored (see counters()) keeping their contents."
+        with self.lock:
+            if counter_bits != self.counter_bits:
+                self.counter_bits = counter_bits
+                self.count_slots()
+
+    def count_slots(self):
+        "Rebuild the slots from the offsets in the ring buffer and merged deltas."
+        self.__slots = counters(self.slotlen, self.counter_bits)
+        for offset in self.__que:
+            if offset is not None:
+                self.__slots[offset] += 1
+        for peer in self.peers.itervalues():
+            for delta, _ in peer.deltas:
+                for offset, count in delta.iteritems():
+                    self.__slots[offset] += count
+
     def __getstate__(self):
-        return self.__que, self.__queoffset, len(self.__slots), self.__per_item
+        return (self.__que, self.__queoffset, len(self.__slots), self.__per_item,
+                self.counter_bits, self.peers, self.__unexported)
 
-    def parameters_changed(self):
+    def parameters_changed(self, slots, items, per_item):
         """Determine of bloom-filter parameters don't match what is being loaded from disk.  
         
+        Args are the constructor arguments the caller wants.
+
         Return true if the parameters are different and incompatible, return false otherwise.
         """
 
-        return len(self.__que) != GFLAGS.items * GFLAGS.per_item or self.slotlen != GFLAGS.slots or self.__per_item != GFLAGS.per_item
+        return len(self.__que) != items * per_item or self.slotlen != slots or self.__per_item != per_item
 
     def __setstate__(self, data):
-        self.__que, self.__queoffset, self.slotlen, self.__per_item = data 
-        self.__slots = [0] * self.slotlen 
-        if self.parameters_changed():
-            print >>sys.stderr, "Parameters changed, bloomfilter wiped, password history lost"
-            self.__que = [None] * GFLAGS.items * GFLAGS.per_item 
-        else:
-            for offset in self.__que:
-                if offset:
-                    self.__slots[offset] += 1
+        # Older sketches were saved without counter_bits, peers and
+        # the export position.
+        data += (0, {}, 0)[len(data) - 4:]
+        (self.__que, self.__queoffset, self.slotlen, self.__per_item, 
+         self.counter_bits, self.peers, self.__unexported) = data 
+        self.lock = threading.RLock()
+        self.count_slots()
         self.choose_hash_function()
 
     def __identity__(self):
-        return self.__slots, self.__que, self.__queoffset 
+        return list(self.__slots), self.__que, self.__queoffset 
             
     def __contains__(self, s):
-        return sum(map(self.test_hash, self.hashes(s))) != 0
+        with self.lock:
+            return sum(map(self.test_hash, self.hashes(s))) != 0
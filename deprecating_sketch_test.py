@@ -26,6 +26,15 @@ class DeprecatingSketchTest(unittest.TestCase):
         self.sketch.add("abc")
         self.assertTrue("abc" in self.sketch)
         
+    def test_claim(self):
+        self.assertTrue(self.sketch.claim("abc"))
+        self.assertTrue("abc" in self.sketch)
+        self.assertFalse(self.sketch.claim("abc"))
+
+    def test_claim_many(self):
+        self.assertEquals(self.sketch.claim_many(["abc", "def", "abc"]),
+                          [True, True, False])
+
     def test_pickle(self):
         self.sketch.add("abc")
         pickle_clone = cPickle.loads(cPickle.dumps(self.sketch))
@@ -37,6 +46,184 @@ class DeprecatingSketchTest(unittest.TestCase):
         self.assertNotEquals(self.sketch, pickle_clone)
 
 
+class DeprecatingSketchParametersTest(unittest.TestCase):
+    def setUp(self):
+        self.sketch = DeprecatingSketch(slots=10, items=2, per_item=1)
+
+    def test_parameters_changed(self):
+        self.assertFalse(self.sketch.parameters_changed(slots=10, items=2, per_item=1))
+        self.assertTrue(self.sketch.parameters_changed(slots=11, items=2, per_item=1))
+        self.assertTrue(self.sketch.parameters_changed(slots=10, items=3, per_item=1))
+
+    def test_pickle_keeps_slot_zero(self):
+        self.sketch.add(0)
+        pickle_clone = cPickle.loads(cPickle.dumps(self.sketch))
+        self.assertTrue(0 in pickle_clone)
+        self.assertFalse(pickle_clone.parameters_changed(slots=10, items=2, per_item=1))
+
+
+class AddManyTest(unittest.TestCase):
+    def sketches(self):
+        return (DeprecatingSketch(slots=50, items=4, per_item=2),
+                DeprecatingSketch(slots=50, items=4, per_item=2))
+
+    def assertReplaysExactly(self, items, before=()):
+        one_at_a_time, batched = self.sketches()
+        for item in before:
+            one_at_a_time.add(item)
+            batched.add(item)
+        for item in items:
+            one_at_a_time.add(item)
+        self.assertEquals(batched.add_many(iter(items)), len(items))
+        self.assertEquals(one_at_a_time, batched)
+
+    def test_short_batch(self):
+        self.assertReplaysExactly(["a", "b"])
+
+    def test_exactly_a_ring(self):
+        self.assertReplaysExactly(["a", "b", "c", "d"], before=["x"])
+
+    def test_long_batch(self):
+        for before in range(5):
+            self.assertReplaysExactly([str(i) for i in range(23)] + range(7),
+                                      before=map(str, range(before)))
+
+    def test_decays_after_replay(self):
+        sketch = DeprecatingSketch(slots=10000, items=4, per_item=2)
+        sketch.add_many(map(str, range(100)))
+        self.assertTrue("99" in sketch)
+        sketch.add_many(["x", "y", "z", "w"])
+        self.assertFalse("99" in sketch)
+
+
+class SaturatingCountersTest(unittest.TestCase):
+    def test_exact_past_saturation(self):
+        for bits in (4, 8):
+            slots = counters(5, bits)
+            for _ in range(300):
+                slots[3] += 1
+            self.assertEquals(slots[3], 300)
+            self.assertEquals(list(slots), [0, 0, 0, 300, 0])
+            for _ in range(300):
+                slots[3] -= 1
+            self.assertEquals(list(slots), [0] * 5)
+            self.assertEquals(slots.overflow, {})
+
+    def test_nibbles_are_independent(self):
+        slots = counters(3, 4)
+        slots[0] = 7
+        slots[1] = 15
+        slots[2] = 1
+        self.assertEquals(list(slots), [7, 15, 1])
+        slots[1] = 2
+        self.assertEquals(list(slots), [7, 2, 1])
+        self.assertRaises(IndexError, slots.__getitem__, 3)
+
+    def test_no_underflow(self):
+        for bits in (4, 8):
+            self.assertRaises(ValueError, counters(2, bits).__setitem__, 0, -1)
+
+    def test_unsupported_width(self):
+        self.assertRaises(ValueError, counters, 2, 2)
+
+
+class CounterBitsTest(unittest.TestCase):
+    def replay(self, counter_bits):
+        sketch = DeprecatingSketch(slots=40, items=50, per_item=2, counter_bits=counter_bits)
+        for i in range(200):
+            sketch.add(i % 2 and str(i) or "123456")
+        return sketch
+
+    def test_same_results(self):
+        plain = self.replay(0)
+        for bits in (4, 8):
+            narrow = self.replay(bits)
+            self.assertEquals(narrow, plain)
+            self.assertEquals([str(i) in narrow for i in range(300)],
+                              [str(i) in plain for i in range(300)])
+
+    def test_set_counter_bits(self):
+        sketch = self.replay(0)
+        sketch.set_counter_bits(4)
+        self.assertTrue(sketch._DeprecatingSketch__slots.overflow)
+        self.assertTrue(isinstance(sketch._DeprecatingSketch__slots, NibbleCounters))
+        self.assertEquals(sketch, self.replay(0))
+
+    def test_pickle(self):
+        sketch = self.replay(8)
+        pickle_clone = cPickle.loads(cPickle.dumps(sketch))
+        self.assertEquals(pickle_clone.counter_bits, 8)
+        self.assertEquals(pickle_clone, sketch)
+
+    def test_smaller(self):
+        plain = DeprecatingSketch(slots=2 ** 16, items=2 ** 12, per_item=2)
+        narrow = DeprecatingSketch(slots=2 ** 16, items=2 ** 12, per_item=2, counter_bits=4)
+        self.assertTrue(utils.deep_sizeof(narrow) * 4 < utils.deep_sizeof(plain))
+
+
+class MergeTest(unittest.TestCase):
+    def setUp(self):
+        self.local = DeprecatingSketch(slots=100, items=3, per_item=1)
+        self.peer = DeprecatingSketch(slots=100, items=3, per_item=1)
+
+    def test_export_delta(self):
+        self.local.add(5)
+        self.local.add(5)
+        self.local.add(7)
+        self.assertEquals(self.local.export_delta(), {5: 2, 7: 1})
+        self.assertEquals(self.local.export_delta(), {})
+        self.local.add(9)
+        self.assertEquals(self.local.export_delta(), {9: 1})
+
+    def test_export_delta_is_bounded(self):
+        for h in range(10):
+            self.local.add(h)
+        self.assertEquals(self.local.export_delta(), {7: 1, 8: 1, 9: 1})
+        self.local.add_many(range(20, 30))
+        self.assertEquals(self.local.export_delta(), {27: 1, 28: 1, 29: 1})
+
+    def test_merge(self):
+        self.peer.add(5)
+        self.local.merge('peer', self.peer.export_delta())
+        self.assertTrue(5 in self.local)
+        self.assertEquals(self.local.export_delta(), {})
+        # Local adds don't push out the peer's.
+        for h in range(10, 13):
+            self.local.add(h)
+        self.assertTrue(5 in self.local)
+
+    def test_merged_deltas_expire(self):
+        self.peer.add(5)
+        self.local.merge('peer', self.peer.export_delta())
+        self.peer.add(6)
+        self.peer.add(7)
+        self.local.merge('peer', self.peer.export_delta())
+        self.assertTrue(5 in self.local)
+        self.peer.add(8)
+        self.local.merge('peer', self.peer.export_delta())
+        self.assertFalse(5 in self.local)
+        self.assertTrue(6 in self.local)
+        self.local.merge('other', {5: 1})
+        self.assertTrue(5 in self.local)
+
+    def test_oversized_delta_refused(self):
+        self.assertRaises(ValueError, self.local.merge, 'peer', {5: 2 ** 31})
+        self.assertRaises(ValueError, self.local.merge, 'peer',
+                          dict((h, 1) for h in range(self.local.ring_size + 1)))
+        self.assertFalse(5 in self.local)
+        self.assertEquals(self.local.peers, {})
+
+    def test_merged_deltas_kept(self):
+        self.local.merge('peer', {5: 2})
+        self.local.add(6)
+        pickle_clone = cPickle.loads(cPickle.dumps(self.local))
+        self.assertEquals(pickle_clone, self.local)
+        self.assertTrue(5 in pickle_clone)
+        self.assertEquals(pickle_clone.export_delta(), {6: 1})
+        self.local.set_counter_bits(4)
+        self.assertTrue(5 in self.local)
+
+
 class VerySmallDeprecatingSketchCrashDummyTest(unittest.TestCase):
     def setUp(self):
         self.sketch = DeprecatingSketchCrashDummy(slots=1000, items=2, per_item=1)
@@ -50,6 +237,12 @@ class VerySmallDeprecatingSketchCrashDummyTest(unittest.TestCase):
         self.sketch.add("123")
         self.assertFalse("abc" in self.sketch)
 
+    def test_failed_claim_does_not_deprecate(self):
+        self.sketch.add("abc")
+        self.sketch.claim("abc")
+        self.sketch.add("def")
+        self.assertTrue("abc" in self.sketch)
+
 
 if __name__ == "__main__":
     unittest.main()
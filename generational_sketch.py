@@ -0,0 +1,197 @@
+#!/usr/bin/env python2.6
+
+"""generational_sketch.
+
+A sketch that forgets passwords after a span of wall-clock time
+rather than after a number of additions.
+
+A DeprecatingSketch protects a password for the next --items
+additions, which at peak might be minutes and at night weeks.  A
+GenerationalSketch instead keeps --generations bloom-filters, each
+covering window / generations seconds.  Passwords are added to the
+newest one, membership is checked against all of them, and when a
+generation's time is up the oldest is dropped whole.  There is no
+ring buffer to remember what to decrement, so memory is just
+generations * slots bytes.
+
+The price is coarser expiry: a password is remembered for somewhere
+between window * (generations - 1) / generations and window seconds.
+"""
+
+import collections
+import deprecating_sketch
+import gflags
+import threading
+import time
+import utils
+
+GFLAGS = gflags.FLAGS
+gflags.DEFINE_integer('window', 24 * 60 * 60,
+"""Seconds a password is remembered for by the generational sketch""")
+
+gflags.DEFINE_integer('generations', 8,
+"""How many pieces the generational sketch's window is cut into.
+More generations expire passwords more precisely but use more memory;
+each one needs slots bytes.""")
+
+SATURATED = 255
+
+
+class GenerationalSketch(utils.Identity):
+
+    """A probabilistic structure that tracks set membership for a window of time.
+
+    Like DeprecatingSketch this will occasionally generate false
+    positives and never a false negative.  Each generation is an
+    ordinary bloom-filter: a password is a member if every one of its
+    slots is set in the same generation.  Slots should be large enough
+    for the number of passwords added in a single generation.
+
+    Counters saturate at 255 rather than wrapping; nothing is ever
+    subtracted from them, so that is harmless.
+    """
+
+    # The constructor arguments parameters_changed compares.
+    parameters = ('slots', 'per_item', 'window', 'generations')
+
+    def __init__(self, slots=GFLAGS.slots, per_item=GFLAGS.per_item,
+                 window=GFLAGS.window, generations=GFLAGS.generations,
+                 clock=time.time):
+        """Create a generational sketch
+
+        Args:
+
+          slots: The number of bloom-filter slots per generation.
+
+          per_item: The number of slots set per item.
+
+          window: The number of seconds items are remembered for.
+
+          generations: The number of bloom-filters window is split
+            across.
+
+          clock: A function returning the current time in seconds.
+        """
+        self.__slots = slots
+        self.__per_item = per_item
+        self.__window = window
+        self.__generations = collections.deque(
+            [bytearray(slots) for _ in range(generations)])
+        self.clock = clock
+        self.__started = clock()
+        self.lock = threading.RLock()
+        self.choose_hash_function()
+
+    def choose_hash_function(self):
+        """Assign to self.hashfunc a hashlib function that provides enough bits."""
+        self.hash_range = self.__slots ** self.__per_item
+        self.hashfunc = deprecating_sketch.hash_function(self.hash_range)
+
+    def hashes(self, s):
+        """Generate hashes for a string (or hash value.)
+
+        Returns:
+          An array per_item in length with hash values in Z_slots.
+        """
+        return deprecating_sketch.hashes(s, self.hashfunc, self.__slots, self.__per_item)
+
+    def period(self):
+        "The number of seconds each generation covers."
+        return float(self.__window) / len(self.__generations)
+
+    def rotate(self):
+        """Drop every generation whose time is up.
+
+        Called with the lock held by everything that reads or writes
+        the sketch, so rotation happens lazily and a quiet sketch costs
+        nothing.
+        """
+        elapsed = int((self.clock() - self.__started) // self.period())
+        if elapsed <= 0:
+            return
+        for _ in range(min(elapsed, len(self.__generations))):
+            self.__generations.pop()
+            self.__generations.appendleft(bytearray(self.__slots))
+        self.__started += elapsed * self.period()
+
+    def add_hash(self, h):
+        """Set a single slot in the current generation."""
+        current = self.__generations[0]
+        if current[h] < SATURATED:
+            current[h] += 1
+
+    def add(self, s):
+        """Add a string (or hash value) to the current generation."""
+        offsets = list(self.hashes(s))
+        with self.lock:
+            self.rotate()
+            map(self.add_hash, offsets)
+
+    def claim(self, s):
+        """Add a string (or hash value) unless it is already a member.
+
+        Returns:
+          True if s was available (and has now been added), False otherwise.
+        """
+        offsets = list(self.hashes(s))
+        with self.lock:
+            self.rotate()
+            if self.member(offsets):
+                return False
+            map(self.add_hash, offsets)
+            return True
+
+    def claim_many(self, items):
+        """Claim each of items in turn, atomically as a whole.
+
+        Returns:
+          A list with claim's result for each item.
+        """
+        with self.lock:
+            return map(self.claim, items)
+
+    def member(self, offsets):
+        "True if every one of offsets is set in some single generation."
+        for generation in self.__generations:
+            if all(generation[h] for h in offsets):
+                return True
+        return False
+
+    def test_hash(self, h):
+        """Test a given slot for membership in any generation.
+
+        Returns 0 if this slot is free, the number of times it has been
+        set (up to 255 per generation) otherwise.
+        """
+        return sum(generation[h] for generation in self.__generations)
+
+    def __contains__(self, s):
+        offsets = list(self.hashes(s))
+        with self.lock:
+            self.rotate()
+            return self.member(offsets)
+
+    def parameters_changed(self, slots, per_item, window, generations):
+        """Determine of bloom-filter parameters don't match what is being loaded from disk.
+
+        Args are the constructor arguments the caller wants.
+
+        Return true if the parameters are different and incompatible, return false otherwise.
+        """
+        return (self.__slots != slots or self.__per_item != per_item or
+                self.__window != window or len(self.__generations) != generations)
+
+    def __getstate__(self):
+        return (self.__slots, self.__per_item, self.__window, self.__started,
+                [str(generation) for generation in self.__generations])
+
+    def __setstate__(self, data):
+        self.__slots, self.__per_item, self.__window, self.__started, generations = data
+        self.__generations = collections.deque(
+            bytearray(generation) for generation in generations)
+        self.clock = time.time
+        self.lock = threading.RLock()
+        self.choose_hash_function()
+
+    def __identity__(self):
+        return self.__generations, self.__started
@@ -0,0 +1,77 @@
+#!/usr/bin/env python2.6
+
+from generational_sketch import *
+import cPickle
+import unittest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class GenerationalSketchTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sketch = GenerationalSketch(
+            slots=1000, per_item=2, window=40, generations=4, clock=self.clock)
+
+    def test_empty_sketch(self):
+        self.assertFalse("abc" in self.sketch)
+
+    def test_placed_item_in_sketch(self):
+        self.sketch.add("abc")
+        self.assertTrue("abc" in self.sketch)
+        self.assertFalse("def" in self.sketch)
+
+    def test_hashes_match_deprecating_sketch(self):
+        self.assertEquals(
+            list(self.sketch.hashes("abc")),
+            list(deprecating_sketch.DeprecatingSketch(slots=1000, items=2, per_item=2).hashes("abc")))
+
+    def test_sketch_expires_by_time(self):
+        self.sketch.add("abc")
+        self.clock.now += 39
+        self.assertTrue("abc" in self.sketch)
+        self.clock.now += 1
+        self.assertFalse("abc" in self.sketch)
+
+    def test_generations_expire_separately(self):
+        self.sketch.add("abc")
+        self.clock.now += 20
+        self.sketch.add("def")
+        self.clock.now += 20
+        self.assertFalse("abc" in self.sketch)
+        self.assertTrue("def" in self.sketch)
+
+    def test_long_idle_drops_everything(self):
+        self.sketch.add("abc")
+        self.clock.now += 10 ** 6
+        self.assertFalse("abc" in self.sketch)
+        self.sketch.add("def")
+        self.assertTrue("def" in self.sketch)
+
+    def test_claim(self):
+        self.assertEquals(self.sketch.claim_many(["abc", "def", "abc"]),
+                          [True, True, False])
+        self.clock.now += 40
+        self.assertTrue(self.sketch.claim("abc"))
+
+    def test_counters_saturate(self):
+        for _ in range(300):
+            self.sketch.add(7)
+        self.assertEquals(self.sketch.test_hash(7), 255)
+
+    def test_pickle(self):
+        self.sketch.add("abc")
+        pickle_clone = cPickle.loads(cPickle.dumps(self.sketch))
+        self.assertEquals(self.sketch, pickle_clone)
+        pickle_clone.clock = self.clock
+        self.assertTrue("abc" in pickle_clone)
+
+
+if __name__ == "__main__":
+    unittest.main()
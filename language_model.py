@@ -7,20 +7,57 @@ Utility methods to process the raw password data file from the Rockyou password
 When run as a program acts as a languge model compiler.
 
 # ./language_model < UserAccount-passwords.txt > language_model.pickle
+
+The compiler can also shrink the model, at the cost of some accuracy.
+--prune_below drops transitions seen fewer times than it (they are
+scored like any unseen transition, with default_bits) and --quantize
+stores every context's bit costs in 8 or 16 bits instead of counts.
+A report of the memory saved and the scoring error on --holdout of the
+input (which is then not trained on) is printed to stderr.
+
+# ./language_model.py --prune_below=3 --quantize=8 < rockyou.txt > lm.pickle
+
+With --orders the compiler builds a BackoffModel instead, which uses
+contexts of up to orders - 1 characters and falls back to shorter
+ones where a context or transition wasn't seen.  --prune_below
+applies to it too.  The memory used by each order and the bits per
+character on --holdout of the input are printed to stderr.
+
+# ./language_model.py --orders=5 --prune_below=2 < rockyou.txt > lm.pickle
 """
 
 
+import array
 import cPickle
+import collections
+import gflags
 import math
+import sys
 import utils 
 
+GFLAGS = gflags.FLAGS
+
+gflags.DEFINE_integer('prune_below', 0, 
+                      'Drop transitions seen fewer than this many times.')
+gflags.DEFINE_enum('quantize', None, ['8', '16'], 
+                   'Store bit costs in this many bits instead of counts.')
+gflags.DEFINE_integer('orders', 0, 
+                      'Compile a BackoffModel of orders 1 to this, instead of '
+                      'the fixed trigram LanguageModel.')
+gflags.DEFINE_float('holdout', 0.01, 
+                    'Fraction of the input held out to measure the error '
+                    'introduced by --prune_below and --quantize.')
+
 
 class Histogram(dict):
     """A histogram that returns the bits entropy of an element."""
 
     def __init__(self, data={}):
         dict.__init__(self, data)
-        self.__counter = sum(data.values())
+        if isinstance(data, Histogram):
+            self.__counter = data.__counter
+        else:
+            self.__counter = sum(data.values())
 
     def bits(self, key, default=None):
         """Return the number of bits entropy for a given value.
@@ -45,14 +82,81 @@ class Histogram(dict):
         self[key] = self.get(key, 0) + count 
         self.__counter += count
 
+    def prune(self, min_count):
+        """Remove every key seen fewer than min_count times.
+
+        The total is left alone, so the remaining keys keep their bits.
+        """
+        for key, count in self.items():
+            if count < min_count:
+                del self[key]
+
     def __setstate__(self, data):
-        self.update(data)
-        self.__counter = sum(self.values())
+        if isinstance(data, tuple):
+            data, self.__counter = data
+            self.update(data)
+        else:
+            self.update(data)
+            self.__counter = sum(self.values())
 
     def __getstate__(self):
+        if self.__counter != sum(self.values()):
+            return dict(self), self.__counter
         return dict(self)
 
 
+class QuantizedHistogram(object):
+    """A read only histogram storing precomputed, quantized bit costs.
+
+    Instead of a dict of counts it keeps the keys as one string and
+    their costs as an array of 8 or 16 bit integers, which is several
+    times smaller.  bits returns cost * scale.
+    """
+
+    __slots__ = ('keys', 'costs', 'scale')
+
+    # Stands in for None (the end of a password) in keys.
+    END = '\0'
+
+    def __init__(self, histogram, scale, typecode):
+        """Quantize a Histogram.
+
+        Args:
+          histogram: The Histogram to quantize.
+          scale: Bits per quantization step.
+          typecode: array typecode for the costs, 'B' or 'H'.
+        """
+        keys = histogram.keys()
+        limit = 2 ** (8 * array.array(typecode).itemsize) - 1
+        self.keys = ''.join(key is None and self.END or key for key in keys)
+        self.costs = array.array(typecode, [min(limit, int(round(histogram.bits(key) / scale)))
+                                            for key in keys])
+        self.scale = scale
+
+    def bits(self, key, default=None):
+        """Return the number of bits entropy for a given value, or default if absent."""
+        index = self.keys.find(key is None and self.END or key)
+        if index < 0:
+            return default
+        return self.costs[index] * self.scale
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __eq__(self, other):
+        return (isinstance(other, QuantizedHistogram) and 
+                (self.keys, self.costs, self.scale) == (other.keys, other.costs, other.scale))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __getstate__(self):
+        return self.keys, self.costs, self.scale
+
+    def __setstate__(self, data):
+        self.keys, self.costs, self.scale = data
+
+
 class DummyHistogram:
     """A "histogram" to fill in for missing values."""
     def bits(self, key, default):
@@ -76,7 +180,8 @@ class LanguageModel(dict):
         self.__dummy_histogram  = DummyHistogram()
 
         for key, value in self.items():
-            self[key] = Histogram(value)
+            if not isinstance(value, QuantizedHistogram):
+                self[key] = Histogram(value)
 
     def extend(self, tuples):
         """Extend this lanugage mode with a series of n-tuples from utils.segment."""
@@ -85,6 +190,33 @@ class LanguageModel(dict):
                 self[context] = Histogram()
             self[context].increment(value)            
 
+    def prune(self, min_count):
+        """Drop transitions seen fewer than min_count times.
+
+        They, and contexts left with nothing in them, are then scored
+        with default_bits like anything else missing from the model.
+        """
+        for context, histogram in self.items():
+            histogram.prune(min_count)
+            if not histogram:
+                del self[context]
+
+    def quantize(self, bits=8):
+        """Replace every histogram with a QuantizedHistogram.
+
+        One scale is shared by the whole model, chosen so the costliest
+        transition still fits.  The model can't be extended afterwards.
+
+        Args:
+          bits: 8 or 16.
+        """
+        typecode = {8: 'B', 16: 'H'}[bits]
+        highest = max([histogram.bits(key) for histogram in self.values() for key in histogram] 
+                      or [0])
+        scale = (highest or 1.0) / (2 ** bits - 1)
+        for context, histogram in self.items():
+            self[context] = QuantizedHistogram(histogram, scale, typecode)
+
     def get(self, key):
         if key not in self:
             return self.__dummy_histogram
@@ -104,6 +236,23 @@ class LanguageModel(dict):
             total_bits += self.get(context).bits(value, self.__default_bits)
         return total_bits 
 
+    def strong_enough(self, s, min_bits):
+        """Decide whether a string has at least min_bits of entropy.
+
+        Same as self.bits(s) >= min_bits, but as no transition costs
+        less than nothing, scoring stops as soon as the running total
+        reaches min_bits.  Strong passwords are the long ones, so they
+        are the ones that gain the most.
+        """
+        if min_bits <= 0:
+            return True
+        total_bits = 0
+        for context, value in utils.all_but_the_last(utils.segment(s)):
+            total_bits += self.get(context).bits(value, self.__default_bits)
+            if total_bits >= min_bits:
+                return True
+        return False
+
     def __getstate__(self):
         """Saves this language model to a string.
 
@@ -133,9 +282,239 @@ def compile(f, n=3):
     for line in list(f):
         language_model.extend(utils.segment(line.strip(), n))
     return language_model
+
+
+class BackoffModel(object):
+    """A language model over contexts of 0 to orders - 1 characters.
+
+    A character is scored by its longest context that has seen it.
+    Each shorter context that has to be tried costs that context's
+    backoff bits first, and a character no context has seen costs
+    unknown_bits on top of the backoffs.  Every cost is worked out by
+    compile_backoff, so scoring a character is at most orders dict
+    lookups for its cost plus one per backoff, and no arithmetic
+    beyond adding.
+
+    Passwords are padded with START before and END after, so the
+    start and end of a password are modelled like any character.
+    """
+
+    START = '\x02'
+    END = '\x03'
+
+    def __init__(self, orders, costs, backoffs, unknown_bits=8.0):
+        """Create a BackoffModel, see compile_backoff.
+
+        Args:
+          orders: The highest order.
+          costs: A dict per order k (from 1) mapping each k character
+            string, context and character, to the bits it costs.
+          backoffs: A dict per order mapping each k - 1 character
+            context to the bits it costs to fall back to order k - 1.
+          unknown_bits: The bits a character seen nowhere costs.
+        """
+        self.orders = orders
+        self.costs = costs
+        self.backoffs = backoffs
+        self.unknown_bits = unknown_bits
+
+    def __len__(self):
+        return sum(len(costs) for costs in self.costs)
+
+    def transition_bits(self, s):
+        "Yield the bits each character of s (and its end) costs."
+        context = self.orders - 1
+        padded = self.START * context + s + self.END
+        orders = range(self.orders - 1, -1, -1)
+        for end in range(context + 1, len(padded) + 1):
+            bits = 0.0
+            for order in orders:
+                key = padded[end - order - 1:end]
+                cost = self.costs[order].get(key)
+                if cost is not None:
+                    yield bits + cost
+                    break
+                bits += self.backoffs[order].get(key[:-1], 0.0)
+            else:
+                yield bits + self.unknown_bits
+
+    def bits(self, s):
+        """Compute the bits of entropy in a string."""
+        return sum(self.transition_bits(s))
+
+    def strong_enough(self, s, min_bits):
+        """Same as self.bits(s) >= min_bits, stopping as soon as it is."""
+        if min_bits <= 0:
+            return True
+        total_bits = 0
+        for bits in self.transition_bits(s):
+            total_bits += bits
+            if total_bits >= min_bits:
+                return True
+        return False
+
+    def memory_by_order(self):
+        """Report the size of each order's tables.
+
+        Returns:
+          A list of dict(order, transitions, contexts, memory) from
+          order 1 up, memory in bytes.
+        """
+        return [dict(order=order + 1,
+                     transitions=len(self.costs[order]),
+                     contexts=len(self.backoffs[order]),
+                     memory=utils.deep_sizeof(self.costs[order]) + 
+                            utils.deep_sizeof(self.backoffs[order]))
+                for order in range(self.orders)]
+
+
+# The most absolute discounting takes off a count.  The estimate from
+# transitions seen once and twice reaches 1 when none were seen twice,
+# which would leave transitions seen once with nothing.
+MAX_DISCOUNT = 0.75
+
+
+def compile_backoff(f, orders=5, min_count=1):
+    """Compile the raw password database into a BackoffModel.
+
+    Transitions are scored with absolute discounting: a context that
+    has seen a character count times out of total keeps (count - D) /
+    total for it, and what the discount frees up (plus anything
+    pruned) is the chance of backing off.  D is estimated for each
+    order from how many transitions were seen once and twice, and is
+    at most MAX_DISCOUNT.
+
+    Args:
+      f: File containing raw password data, one password per line.
+      orders: The highest order, so contexts of up to orders - 1
+        characters.
+      min_count: Drop transitions of order 2 and up seen fewer than
+        this many times.
+
+    Returns:
+      BackoffModel
+    """
+    counts = [collections.defaultdict(int) for _ in range(orders)]
+    start = BackoffModel.START * (orders - 1)
+    for line in f:
+        padded = start + line.strip() + BackoffModel.END
+        for end in range(orders, len(padded) + 1):
+            for order in range(orders):
+                counts[order][padded[end - order - 1:end]] += 1
+
+    costs = []
+    backoffs = []
+    for order, order_counts in enumerate(counts):
+        seen_once = sum(1 for count in order_counts.itervalues() if count == 1)
+        seen_twice = sum(1 for count in order_counts.itervalues() if count == 2)
+        discount = MAX_DISCOUNT
+        if seen_once:
+            discount = min(float(seen_once) / (seen_once + 2 * seen_twice), MAX_DISCOUNT)
+        totals = collections.defaultdict(int)
+        for key, count in order_counts.iteritems():
+            totals[key[:-1]] += count
+        kept = collections.defaultdict(float)
+        order_costs = {}
+        for key, count in order_counts.iteritems():
+            if order and count < min_count:
+                continue
+            p = (count - discount) / totals[key[:-1]]
+            order_costs[key] = -math.log(p, 2)
+            kept[key[:-1]] += p
+        costs.append(order_costs)
+        backoffs.append(dict((context, -math.log(1 - kept[context], 2))
+                             for context in totals))
+    return BackoffModel(orders, costs, backoffs)
+
+
+def print_backoff_report(model, sample=(), out=sys.stderr):
+    "Print the memory used by each order, and bits per character on sample."
+    for row in model.memory_by_order():
+        print >>out, ("order %(order)d: %(transitions)d transitions, "
+                      "%(contexts)d contexts, " % row + 
+                      "%.1f MB" % (row['memory'] / 2.0 ** 20))
+    passwords = [line.strip() for line in sample]
+    if passwords:
+        characters = sum(len(password) + 1 for password in passwords)
+        print >>out, "%.3f bits per character over %d held out passwords" % (
+            sum(model.bits(password) for password in passwords) / characters, len(passwords))
+
+
+def split_holdout(lines, fraction):
+    """Split lines into (training, held out), holding out every 1/fraction'th line."""
+    if not fraction:
+        return lines, []
+    every = max(1, int(round(1 / fraction)))
+    return ([line for offset, line in enumerate(lines) if offset % every],
+            lines[::every])
+
+
+def compress(model, prune_below=0, quantize=None, sample=()):
+    """Prune and quantize a model, reporting what that cost.
+
+    Args:
+      model: The LanguageModel to compress in place.
+      prune_below: See LanguageModel.prune, 0 to skip.
+      quantize: See LanguageModel.quantize, None to skip.
+      sample: Passwords to measure the scoring error with.
+
+    Returns:
+      A dict describing the contexts, memory and error before and after.
+    """
+    passwords = [line.strip() for line in sample]
+    before = [model.bits(password) for password in passwords]
+    report = dict(contexts_before=len(model), memory_before=utils.deep_sizeof(model))
+    if prune_below:
+        model.prune(prune_below)
+    if quantize:
+        model.quantize(quantize)
+    errors = [abs(model.bits(password) - bits) for password, bits in zip(passwords, before)]
+    report.update(contexts_after=len(model), 
+                  memory_after=utils.deep_sizeof(model),
+                  sample=len(errors),
+                  mean_error=errors and sum(errors) / len(errors) or 0.0,
+                  max_error=max(errors or [0.0]))
+    return report
+
+
+def print_report(report, out=sys.stderr):
+    print >>out, "contexts: %(contexts_before)d -> %(contexts_after)d" % report
+    print >>out, "memory: %.1f MB -> %.1f MB (%.0f%% saved)" % (
+        report['memory_before'] / 2.0 ** 20, report['memory_after'] / 2.0 ** 20,
+        100.0 * (1 - float(report['memory_after']) / max(1, report['memory_before'])))
+    print >>out, ("error over %(sample)d held out passwords: "
+                  "mean %(mean_error).3f bits, max %(max_error).3f bits" % report)
+
+
+def main(argv):
+    try:
+        argv = GFLAGS(argv)  # parse flags
+    except gflags.FlagsError, e:
+        print >>sys.stderr, '%s\nUsage: %s ARGS < passwords > model\n%s' % (e, sys.argv[0], GFLAGS)
+        sys.exit(1)
+    lines = list(sys.stdin)
+    if GFLAGS.orders:
+        lines, held_out = split_holdout(lines, GFLAGS.holdout)
+        model = compile_backoff(lines, GFLAGS.orders, GFLAGS.prune_below or 1)
+        print_backoff_report(model, held_out)
+        cPickle.dump(model, sys.stdout, cPickle.HIGHEST_PROTOCOL)
+        return
+    if not (GFLAGS.prune_below or GFLAGS.quantize):
+        cPickle.dump(compile(lines), sys.stdout)
+        return
+    lines, held_out = split_holdout(lines, GFLAGS.holdout)
+    model = compile(lines)
+    print_report(compress(model, GFLAGS.prune_below, 
+                          GFLAGS.quantize and int(GFLAGS.quantize), held_out))
+    cPickle.dump(model, sys.stdout, cPickle.HIGHEST_PROTOCOL)
             
 
 if __name__ == "__main__":
-    import sys
-    cPickle.dump(compile(sys.stdin), sys.stdout)
+    # Pickle models as language_model.*, not __main__.*, which only
+    # loads into a process with the same classes in its __main__.
+    sys.modules['language_model'] = sys.modules[__name__]
+    for value in globals().values():
+        if getattr(value, '__module__', None) == __name__:
+            value.__module__ = 'language_model'
+    main(sys.argv)
 
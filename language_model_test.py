@@ -30,7 +30,143 @@ class LanguageModelTest(unittest.TestCase):
     def test_construction(self):
         self.assertEqual(LanguageModel(self.language_model),
                          self.language_model)
+
+    def test_strong_enough(self):
+        for password in ["aaa", "aab", "abba", "zzzzzz", ""]:
+            for min_bits in [0, 2.0, 3.0, 10, 40]:
+                self.assertEquals(self.language_model.strong_enough(password, min_bits),
+                                  self.language_model.bits(password) >= min_bits)
+
+    def test_strong_enough_stops_early(self):
+        lookups = []
+        get = self.language_model.get
+        self.language_model.get = lambda context: lookups.append(context) or get(context)
+        self.assertTrue(self.language_model.strong_enough("z" * 100, 18))
+        self.assertEquals(len(lookups), 3)
         
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.language_model = compile(StringIO.StringIO("aaa\naab\nabb\naaa\nbbbb"))
+
+    def test_prune_keeps_remaining_bits(self):
+        before = self.language_model[('a', 'a')].bits('a')
+        self.language_model.prune(2)
+        self.assertEquals(self.language_model[('a', 'a')].bits('a'), before)
+        self.assertEquals(self.language_model[('a', 'a')].bits('b', 6.5), 6.5)
+        self.assertFalse(('a', 'b') in self.language_model)
+
+    def test_pruned_histogram_pickles(self):
+        self.language_model.prune(2)
+        pickle_clone = cPickle.loads(cPickle.dumps(self.language_model))
+        self.assertEquals(pickle_clone[('a', 'a')].bits('a'),
+                          self.language_model[('a', 'a')].bits('a'))
+
+    def test_quantize(self):
+        before = self.language_model.bits("aab")
+        self.language_model.quantize(8)
+        self.assertTrue(isinstance(self.language_model[(None, None)], QuantizedHistogram))
+        self.assertAlmostEquals(self.language_model.bits("aab"), before, 1)
+        self.assertEquals(self.language_model[('a', 'a')].bits('z', 6.5), 6.5)
+
+    def test_quantized_pickles(self):
+        self.language_model.quantize(16)
+        for protocol in (0, cPickle.HIGHEST_PROTOCOL):
+            pickle_clone = cPickle.loads(cPickle.dumps(self.language_model, protocol))
+            self.assertEqual(pickle_clone, self.language_model)
+            self.assertEqual(pickle_clone.bits("aab"), self.language_model.bits("aab"))
+
+    def test_compress_report(self):
+        report = compress(self.language_model, 2, 8, ["aab", "abba"])
+        self.assertEquals(report['sample'], 2)
+        self.assertTrue(report['memory_after'] < report['memory_before'])
+        self.assertTrue(report['max_error'] >= report['mean_error'] >= 0)
+
+    def test_split_holdout(self):
+        self.assertEquals(split_holdout(range(10), 0.25), ([1, 2, 3, 5, 6, 7, 9], [0, 4, 8]))
+        self.assertEquals(split_holdout(range(3), 0), (range(3), []))
+
+
+class CountingDict(dict):
+    def __init__(self, items, lookups):
+        dict.__init__(self, items)
+        self.lookups = lookups
+
+    def get(self, key, default=None):
+        self.lookups.append(key)
+        return dict.get(self, key, default)
+
+
+class BackoffModelTest(unittest.TestCase):
+    def setUp(self):
+        self.model = compile_backoff(StringIO.StringIO("aaa\naab\nabb\naaa"), 3)
+
+    def test_compile(self):
+        self.assertEquals(self.model.orders, 3)
+        self.assertEquals(sorted(self.model.costs[0]), ['\x03', 'a', 'b'])
+        self.assertEquals(sorted(self.model.backoffs[2])[:2], ['\x02\x02', '\x02a'])
+        self.assertTrue('aab' in self.model.costs[2])
+
+    def test_probabilities_sum_to_one(self):
+        for order in range(3):
+            for context, backoff in self.model.backoffs[order].items():
+                total = 2 ** -backoff + sum(2 ** -cost
+                                            for key, cost in self.model.costs[order].items()
+                                            if key[:-1] == context)
+                self.assertAlmostEquals(total, 1.0)
+
+    def test_entropy(self):
+        costs = self.model.costs[2]
+        self.assertAlmostEquals(self.model.bits("aaa"),
+                                costs['\x02\x02a'] + costs['\x02aa'] + 
+                                costs['aaa'] + costs['aa\x03'])
+        self.assertTrue(self.model.bits("aab") > self.model.bits("aaa"))
+        self.assertTrue(self.model.bits("z") > self.model.unknown_bits)
+
+    def test_backs_off(self):
+        costs, backoffs = self.model.costs, self.model.backoffs
+        self.assertFalse('\x02b' in backoffs[2])
+        self.assertAlmostEquals(self.model.bits("ba"),
+                                backoffs[2]['\x02\x02'] + backoffs[1]['\x02'] + costs[0]['b'] + 
+                                backoffs[1]['b'] + costs[0]['a'] + 
+                                costs[1]['a\x03'])
+
+    def test_lookups_are_bounded(self):
+        lookups = []
+        self.model.costs = [CountingDict(costs, lookups) for costs in self.model.costs]
+        self.model.backoffs = [CountingDict(backoffs, []) for backoffs in self.model.backoffs]
+        self.model.bits("zzzz")
+        self.assertEquals(len(lookups), 3 * 5)
+
+    def test_strong_enough(self):
+        for password in ["aaa", "aab", "abba", "zzzzzz", ""]:
+            for min_bits in [0, 2.0, 3.0, 10, 40]:
+                self.assertEquals(self.model.strong_enough(password, min_bits),
+                                  self.model.bits(password) >= min_bits)
+
+    def test_pickling(self):
+        pickle_clone = cPickle.loads(cPickle.dumps(self.model, cPickle.HIGHEST_PROTOCOL))
+        self.assertEquals(pickle_clone.costs, self.model.costs)
+        self.assertEquals(pickle_clone.bits("abba"), self.model.bits("abba"))
+
+    def test_prune(self):
+        pruned = compile_backoff(StringIO.StringIO("aaa\naab\nabb\naaa"), 3, 2)
+        self.assertEquals(pruned.costs[0], self.model.costs[0])
+        self.assertFalse('abb' in pruned.costs[2])
+        self.assertTrue('aaa' in pruned.costs[2])
+        self.assertTrue(pruned.backoffs[2]['ab'] < self.model.backoffs[2]['ab'])
+
+    def test_small_corpus(self):
+        for lines in [['abc'], ['password', 'letmein', 'qwerty']]:
+            model = compile_backoff(lines, 3)
+            self.assertTrue(0 < model.bits(lines[0]) < model.bits('zzz'))
+
+    def test_memory_by_order(self):
+        report = self.model.memory_by_order()
+        self.assertEquals([row['order'] for row in report], [1, 2, 3])
+        self.assertEquals(report[0]['transitions'], 3)
+        self.assertEquals(report[0]['contexts'], 1)
+        self.assertTrue(all(row['memory'] > 0 for row in report))
+
 if __name__ == "__main__":
     unittest.main()
     
@@ -72,7 +72,12 @@ Because 123456 is available, I've decided to use it:
 
 There is nothing here preventing two people from requesting the same
 password at the same time.  See the README file for a discussion of
-why this isn't a problem.
+why this isn't a problem.  If it is a problem for you, POST to claim
+instead; it adds the password only if it is available and tells you
+which it was.
+
+# curl  -d password=123456 127.0.0.1:8000/claim
+false
 
 Now lets see if this password is available.e
 
@@ -102,6 +107,8 @@ Caveats
   We're passing passwords in the clear with this API.  I hope this
   server isn't facing the public Internet and talking to a java script
   client in the user's browser.
+  password_oracle_client.py hashes passwords before they leave your
+  application server; use it rather than hand rolling the hash.
 
   When adding passwords this program doesn't care if you are adding
   the same or different passwords; old entries are flushed after
@@ -109,15 +116,29 @@ Caveats
 """
 
 import BaseHTTPServer
+import Queue
+import SocketServer
 import cPickle
+import blocked_sketch
 import cgi
 import deprecating_sketch
+import generational_sketch
 import gflags 
 import gzip
+import itertools
 import json
 import language_model
+import os
+import re
+import select 
 import signal 
+import socket
+import sketch_protocol
+import sketch_sync
 import sys 
+import threading
+import time
+import traffic_log
 import urlparse 
 import utils
 
@@ -127,19 +148,183 @@ GFLAGS = gflags.FLAGS
 
 gflags.DEFINE_string('path', '/', 'URL prefix.')
 gflags.DEFINE_string('host', '', 'Host addr to listen to')
-gflags.DEFINE_integer('port', 8000, 'Port addr to listen to')
+gflags.DEFINE_integer('port', 8000, 'Port addr to listen to.  0 disables TCP.')
+gflags.DEFINE_string('unix_socket', None, 
+                     'Pathname of a Unix domain socket to serve HTTP on, '
+                     'alongside --port or instead of it.')
 gflags.DEFINE_string('language_model', None, 'Language model to load')
 gflags.DEFINE_string('bloom_filter', 'bloom_filter.pickle', 'Bloomfilter to load')
+gflags.DEFINE_integer('snapshot_interval', 0, 
+                      'Seconds between background snapshots of the sketches.  '
+                      '0 only saves them on shutdown.')
+gflags.DEFINE_enum('sketch', 'deprecating', ['deprecating', 'blocked', 'generational'], 
+                   'deprecating forgets a password after --items additions, '
+                   'blocked does too but keeps each password\'s slots in one '
+                   '--block, generational forgets after --window seconds.')
+gflags.DEFINE_multistring('namespace', [], 
+                          'Serve an extra, independent sketch under PATH/NAME/.  '
+                          'Given as NAME[:key=value...] where the keys slots, items, '
+                          'per_item, block, window and generations override the flags of the '
+                          'same name for this sketch, and bloom_filter gives its file '
+                          '(by default --bloom_filter with .NAME before the extension.)  '
+                          'May be repeated.')
+gflags.DEFINE_integer('protocol_port', 0, 
+                      'Port addr to listen to for the binary hash protocol '
+                      '(see sketch_protocol.py.)  0 disables it.')
+gflags.DEFINE_string('protocol_unix_socket', None, 
+                     'Pathname of a Unix domain socket to serve the binary '
+                     'hash protocol on.')
+gflags.DEFINE_string('unix_socket_mode', '0660', 
+                     'Octal permissions given to Unix domain sockets')
+gflags.DEFINE_string('capture', None, 
+                     'Append a record of every request, with passwords and hashes '
+                     'fingerprinted, to this file for replay_traffic.py.')
+gflags.DEFINE_float('min_bits', 18, 
+                    'Entropy strong_enough.json requires when the request '
+                    'gives no min_bits.')
+gflags.DEFINE_integer('workers', 0, 
+                      'Threads answering HTTP requests from a bounded queue.  '
+                      '0 answers them one at a time as they are accepted, '
+                      'with no admission control.')
+gflags.DEFINE_integer('queue_size', 64, 
+                      'HTTP requests that may wait for a worker; any more are '
+                      'answered 503 at once.  entropy, all and strong_enough '
+                      'requests, and connections whose request line hasn\'t '
+                      'arrived when they are accepted, may only fill half of '
+                      'the queue.')
+gflags.DEFINE_float('deadline', 1.0, 
+                    'Seconds from accepting an HTTP request to answering it.  '
+                    'Requests still queued when it passes are answered 503, and '
+                    'clients that haven\'t sent the whole request by then are '
+                    'disconnected.  Time spent computing the answer isn\'t '
+                    'limited, and each write of it may take this long again.')
+gflags.DEFINE_integer('retry_after', 1, 
+                      'Seconds clients are asked to wait (Retry-After) when a '
+                      'request is refused for lack of capacity.')
 
 
 HTTP_UNAVAILABLE = 503
 HTTP_OK = 200 
 HTTP_CREATED = 201 
+HTTP_ACCEPTED = 202 
+HTTP_BAD_REQUEST = 400
+HTTP_FORBIDDEN = 403
 HTTP_NOT_FOUND = 404
+HTTP_TOO_LARGE = 413
 HTTP_BAD_FORMAT = 415 
 
 ERR_INTERRUPTED = 4 
 
+# Sent, without reading the request, when it can't be served in time.
+OVERLOADED = ('HTTP/1.0 503 Service Unavailable\r\n'
+              'Retry-After: %d\r\n'
+              'Content-Length: 0\r\n'
+              '\r\n')
+
+PRIORITY_CHEAP = 0
+PRIORITY_EXPENSIVE = 1
+
+# Commands that score a password against the language model.
+EXPENSIVE_COMMANDS = ('entropy', 'all', 'strong_enough')
+
+
+def first_values(data):
+    """Flatten the dict of lists returned by urlparse.parse_qs.
+
+    Only the first value of a repeated field is kept, matching what
+    the handlers have always used.
+    """
+    return dict((key, values[0]) for key, values in data.items())
+
+
+NAMESPACE_OPTIONS = ('slots', 'items', 'per_item', 'block', 'window', 'generations')
+
+def parse_namespace(spec):
+    """Parse a --namespace flag.
+
+    Args:
+      spec: NAME[:key=value...], i.e. "admin:slots=4096:items=512"
+
+    Returns:
+      (name, options) where options maps each given key to its value.
+
+    Raises:
+      ValueError if spec can't be parsed.
+    """
+    fields = spec.split(':')
+    name = fields[0]
+    if not re.match(r'^[\w-]+$', name):
+        raise ValueError('Bad namespace name %r' % name)
+    options = {}
+    for field in fields[1:]:
+        key, _, value = field.partition('=')
+        if key == 'bloom_filter':
+            options[key] = value
+        elif key in NAMESPACE_OPTIONS:
+            options[key] = int(value)
+        else:
+            raise ValueError('Unknown namespace option %r' % key)
+    return name, options
+
+
+def request_priority(request):
+    """Tell cheap requests from expensive ones before accepting them.
+
+    The request line is peeked at, not read, so the handler still sees
+    the whole request.  This runs on the thread accepting connections,
+    so it doesn't wait: a client that connects and only then sends its
+    request line, slowly or not, is classed as expensive and may only
+    use half of the queue.
+
+    Returns:
+      PRIORITY_EXPENSIVE for language model scoring, and for
+      connections whose request line hasn't arrived yet, otherwise
+      PRIORITY_CHEAP.
+    """
+    try:
+        line = request.recv(1024, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+    except socket.error:
+        return PRIORITY_EXPENSIVE
+    fields = line.split(None, 2)
+    if len(fields) < 2 or '\n' not in line:
+        return PRIORITY_EXPENSIVE
+    path = urlparse.urlparse(fields[1])[2]
+    command = path.rpartition('/')[2].partition('.')[0]
+    if command in EXPENSIVE_COMMANDS:
+        return PRIORITY_EXPENSIVE
+    return PRIORITY_CHEAP
+
+
+class DeadlineSocket(object):
+    """A socket whose reads must all finish by an absolute deadline.
+
+    socket.settimeout limits each read on its own, so a client sending
+    a byte just inside each timeout could hold a worker for ever.
+    Writes get send_timeout seconds each.
+    """
+
+    def __init__(self, sock, deadline, send_timeout):
+        self.sock = sock
+        self.deadline = deadline
+        self.send_timeout = send_timeout
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def recv(self, *args):
+        remaining = self.deadline - time.time()
+        if remaining <= 0:
+            raise socket.timeout('deadline passed')
+        self.sock.settimeout(remaining)
+        return self.sock.recv(*args)
+
+    def sendall(self, data, *args):
+        self.sock.settimeout(self.send_timeout)
+        return self.sock.sendall(data, *args)
+
+    def makefile(self, mode='r', bufsize=-1):
+        return socket._fileobject(self, mode, bufsize)
+
 
 class PasswordRequired:
     "Raised to note that a particular handler requires a password"
@@ -147,6 +332,9 @@ class PasswordRequired:
 class BadPrefix:
     "Raised if the URI prefix isn't correct (wrong branch.)"
 
+class BadArgument:
+    "Raised if a query argument can't be parsed"
+
 class PasswordOracleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     """PasswordORacleRequestHander
     
@@ -164,6 +352,17 @@ class PasswordOracleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
       POST PREFIX/add password=123456
       POST PREFIX/add hash=36
 
+    * Add a password only if it is available, in one step.  Returns
+      whether it was available; nobody else can claim the same
+      password in between.
+
+      POST PREFIX/claim password=123456 -> bool
+      POST PREFIX/claim {"hashes": [36, 37]} -> [bool, bool]
+
+      The body may be application/x-www-form-urlencoded (as sent by
+      curl -d) or application/json, i.e. {"hash": 36}.  Both are
+      decoded without going through cgi.FieldStorage.
+
     * Check the entropy of a password against a fixed precompiled
       language model (more bits is better, for a large web service
       your usres should have ~15-20 bits minimum)
@@ -175,12 +374,48 @@ class PasswordOracleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
       sequentially
       GET PREFIX/all.json&password=123 -> dict(entropy=float, available=bool)
 
+    * Check that a password has at least min_bits of entropy (by
+      default --min_bits) and is available.  Scoring stops as soon as
+      min_bits is reached, so this is cheaper than all.json for the
+      long passwords that pass.
+      GET PREFIX/strong_enough.json?password=123&min_bits=18 
+        -> dict(strong_enough=bool, available=bool)
+
     * Find this database's required divisor for hash values
       GET PREFIX/get_hash.json -> 65536 
 
+    * Save the sketches in the background, and check how recent the
+      last snapshot is (age and duration are in seconds.)
+
+      POST PREFIX/snapshot
+      GET PREFIX/snapshot.json -> dict(in_progress=bool, age=float,
+                                       duration=float, failures=int)
+
+    * Merge the recent adds of a peer oracle (see sketch_sync.py.)
+
+      POST PREFIX/merge?origin=NAME  (an encoded delta)
+
+      NAME must be one of the --accept_origin flags, and anything
+      else is refused with 403.
+
+    * Check how loaded the server is (see --workers.)
+
+      GET PREFIX/admission.json -> dict(queued=int, refused=int,
+                                        expired=int)
+
+    Each of these can also be asked of a sketch added with
+    --namespace, i.e. GET PREFIX/admin/available.json?hash=37.  All
+    namespaces share one language model.
+
     Only .json is supported right now.
     """
 
+    def address_string(self):
+        "Unix domain socket clients have no address; log the socket instead."
+        if self.server.address_family == socket.AF_UNIX:
+            return self.client_address[0]
+        return BaseHTTPServer.BaseHTTPRequestHandler.address_string(self)
+
     def path_prefix(self):
         """Get the path prefix from GFLAGS.path.  
         
@@ -188,38 +423,130 @@ class PasswordOracleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         """
         return GFLAGS.path
 
-    def get_command(self):
-        "Returns the current command (i.e. all, entropy, etc etc.)"
+    def parse_path(self):
+        """Decode the request path once.
+
+        Returns:
+          (path, query) where query maps each field to its first
+          value.  The result is cached against self.path, so
+          compute_all and friends can ask for the password, hash and
+          command as often as they like without reparsing the URL.
+        """
+        try:
+            parsed_for, parsed = self.__parsed_path
+            if parsed_for == self.path:
+                return parsed
+        except AttributeError:
+            pass
         scheme, netloc, path,  params, query, fragment = urlparse.urlparse(self.path)
+        parsed = path, first_values(urlparse.parse_qs(query))
+        self.__parsed_path = self.path, parsed
+        return parsed
+
+    def get_query(self):
+        "get_query returns the decoded query string of a GET request."
+        return self.parse_path()[1]
+
+    def split_command(self):
+        """Returns the namespace and command of the current request.
+
+        PREFIX/admin/available.json is ('admin', 'available.json'),
+        PREFIX/available.json is ('', 'available.json').
+        """
+        path = self.parse_path()[0]
         if utils.prefixed(path, self.path_prefix()):
-            return path[len(self.path_prefix()):]
+            namespace, _, command = path[len(self.path_prefix()):].rpartition('/')
+            return namespace, command
         raise BadPrefix()
 
+    def get_command(self):
+        "Returns the current command (i.e. all, entropy, etc etc.)"
+        return self.split_command()[1]
+
+    def get_sketch(self):
+        "Returns the sketch of the current request's namespace."
+        namespace = self.split_command()[0]
+        if not namespace:
+            return self.server.sketch
+        sketch = self.server.sketches.get(namespace)
+        if sketch is None:
+            raise BadPrefix()
+        return sketch
+
     def get_password(self):
         "get_password returns the password for a GET request."
-        scheme, netloc, path,  params, query, fragment = urlparse.urlparse(self.path)
-        data = cgi.parse_qs(query)
-        password = data.get('password')
-        if password:
-            return password[0]
+        return self.get_query().get('password')
 
     def get_hash(self):
         "get_password returns the hash for a GET request."
-        scheme, netloc, path,  params, query, fragment = urlparse.urlparse(self.path)
-        data = cgi.parse_qs(query)
-        hash = data.get('hash')
+        hash = self.get_query().get('hash')
         if hash:
-            return int(hash[0])
+            try:
+                return int(hash)
+            except ValueError:
+                raise BadArgument()
+
+    def get_content_length(self):
+        "Returns the length of a POST request's body, 0 if there is none."
+        try:
+            return int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            raise BadArgument()
+
+    def get_post_data(self):
+        """Decode the body of a POST request once.
+
+        application/x-www-form-urlencoded and application/json bodies
+        are read straight off rfile; anything else (i.e. multipart
+        forms) falls back to the much slower cgi.FieldStorage.
+
+        Returns:
+          A dict mapping each field to its (first) value.
+
+        Raises:
+          BadArgument if a JSON body can't be decoded.
+        """
+        try:
+            return self.__post_data
+        except AttributeError:
+            pass
+        content_type, _ = cgi.parse_header(self.headers.get('Content-Type') or '')
+        length = self.get_content_length()
+        if content_type == 'application/x-www-form-urlencoded':
+            data = first_values(urlparse.parse_qs(self.rfile.read(length)))
+        elif content_type == 'application/json':
+            try:
+                data = json.loads(self.rfile.read(length))
+            except ValueError:
+                raise BadArgument()
+            if not isinstance(data, dict):
+                data = {}
+        else:
+            form = cgi.FieldStorage(
+                fp=self.rfile, 
+                headers=self.headers,
+                environ={'REQUEST_METHOD':'POST',
+                         'CONTENT_TYPE':self.headers['Content-Type'],
+                         })
+            data = dict((key, form.getfirst(key)) for key in form.keys())
+        self.__post_data = data
+        return data
 
     def get_post_password(self):
         "get_post_password returns the password for a POST requiest."
-        form = cgi.FieldStorage(
-            fp=self.rfile, 
-            headers=self.headers,
-            environ={'REQUEST_METHOD':'POST',
-                     'CONTENT_TYPE':self.headers['Content-Type'],
-                     })
-        return form['password'].value
+        password = self.get_post_data().get('password')
+        if isinstance(password, unicode):
+            return password.encode('utf-8')
+        return password
+
+    def get_post_hash(self):
+        "get_post_hash returns the hash for a POST request."
+        hash = self.get_post_data().get('hash')
+        if hash:
+            try:
+                return int(hash)
+            except (TypeError, ValueError):
+                raise BadArgument()
 
     def compute_entropy(self):
         """compute_entropy
@@ -245,7 +572,7 @@ class PasswordOracleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         password = self.get_password() or self.get_hash()
         if not password:
             raise PasswordRequired()
-        return password not in self.server.sketch
+        return password not in self.get_sketch()
 
     def compute_all(self):
         """compute_all
@@ -259,8 +586,54 @@ class PasswordOracleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         return dict(entropy=self.compute_entropy(),
                     available=self.compute_available())
 
+    def compute_strong_enough(self):
+        """compute_strong_enough
+
+        Checks a password against a minimum entropy and for
+        availability.
+
+        Returns:
+          dict(strong_enough = true/false,
+               available = true/false), or None if no language model
+          was loaded.
+        """
+        password = self.get_password()
+        if not password:
+            raise PasswordRequired()
+        min_bits = self.get_query().get('min_bits')
+        if min_bits is None:
+            min_bits = GFLAGS.min_bits
+        try:
+            min_bits = float(min_bits)
+        except ValueError:
+            raise BadArgument()
+        if self.server.language_model:
+            return dict(strong_enough=self.server.language_model.strong_enough(password, min_bits),
+                        available=self.compute_available())
+
     def compute_hash_range(self):
-        return self.server.sketch.hash_range
+        return self.get_sketch().hash_range
+
+    def compute_snapshot(self):
+        "Returns the state of the background snapshots, see PasswordOracleServer.snapshot_status"
+        return self.server.snapshot_status()
+
+    def compute_admission(self):
+        "Returns the state of the request queue, see PasswordOracleServer.admission_status"
+        return self.server.admission_status()
+
+    def capture(self, method):
+        """Add the current request to the server's traffic log, if it keeps one."""
+        log = self.server.traffic_log
+        command = self.get_command().partition('.')[0]
+        if log is None or command not in traffic_log.COMMANDS:
+            return
+        arguments = method == 'POST' and self.get_post_data() or self.get_query()
+        try:
+            log.record(method, command, arguments, time.time())
+        except Exception, ex:
+            # Never let the log get in the way of answering.
+            print >>sys.stderr, "Capture failed: %s" % ex
 
     def password_required(self, password):
         "Raises PasswordRequired if not password"
@@ -272,13 +645,17 @@ class PasswordOracleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         "Handle GET requests"
         try:
             function, format = self.get_command().split('.', 2)
+            self.get_sketch()
         except BadPrefix:
             return self.send_response(HTTP_NOT_FOUND, 'Wrong prefix')
         
         function = {'entropy':self.compute_entropy,
                     'available':self.compute_available,
                     'hash_range':self.compute_hash_range,
-                    'all':self.compute_all}.get(function)
+                    'snapshot':self.compute_snapshot,
+                    'admission':self.compute_admission,
+                    'all':self.compute_all,
+                    'strong_enough':self.compute_strong_enough}.get(function)
 
         format = {'json': json.dumps}.get(format)
         
@@ -286,11 +663,14 @@ class PasswordOracleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             return self.send_response(HTTP_NOT_FOUND, 'Unknown function')
         if not format:
             return self.send_response(HTTP_BAD_FORMAT, 'Unknown format')
+        self.capture('GET')
         try:
             data = function()
         except PasswordRequired:
             self.send_response(HTTP_NOT_FOUND, 'No password provided')
             return 
+        except BadArgument:
+            return self.send_response(HTTP_BAD_REQUEST, 'Bad argument')
 
         if data is None:
             return self.send_response(HTTP_UNAVAILABLE)
@@ -300,21 +680,93 @@ class PasswordOracleRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         self.wfile.write(format(data))
 
 
+    def post_add(self):
+        "Add the POSTed password or hash to the sketch."
+        password = self.get_post_password()
+        hash = self.get_post_hash()
+        if not (password or hash):
+            return self.send_response(HTTP_NOT_FOUND, 'Missing password')
+
+        self.send_response(HTTP_CREATED)
+        self.end_headers()
+        self.get_sketch().add(password or hash)
+
+    def post_claim(self):
+        """Add the POSTed password(s) or hash(es) to the sketch if available.
+
+        Answers with the prior availability: a bool for a single
+        password or hash, a list of bools for a batch.
+
+        Raises:
+          BadArgument if a batch has anything but strings in passwords
+          or integers in hashes.
+        """
+        data = self.get_post_data()
+        if isinstance(data.get('passwords'), list):
+            passwords = data['passwords']
+            if not all(isinstance(password, basestring) for password in passwords):
+                raise BadArgument()
+            data = self.get_sketch().claim_many(
+                [password.encode('utf-8') for password in passwords])
+        elif isinstance(data.get('hashes'), list):
+            hashes = data['hashes']
+            if not all(isinstance(hash, (int, long)) and not isinstance(hash, bool)
+                       for hash in hashes):
+                raise BadArgument()
+            data = self.get_sketch().claim_many(hashes)
+        else:
+            password = self.get_post_password() or self.get_post_hash()
+            if not password:
+                return self.send_response(HTTP_NOT_FOUND, 'Missing password')
+            data = self.get_sketch().claim(password)
+
+        self.send_response(HTTP_OK)
+        self.end_headers()
+        self.wfile.write(json.dumps(data))
+
+    def post_snapshot(self):
+        "Start a background snapshot of the sketches (unless one is running.)"
+        self.server.snapshot()
+        self.send_response(HTTP_ACCEPTED)
+        self.end_headers()
+
+    def post_merge(self):
+        "Merge a peer's delta, see sketch_sync.py."
+        origin = self.get_query().get('origin')
+        sketch = self.get_sketch()
+        if not origin:
+            return self.send_response(HTTP_NOT_FOUND, 'Missing origin')
+        if origin not in self.server.accepted_origins:
+            return self.send_response(HTTP_FORBIDDEN, 'Unknown origin')
+        if not hasattr(sketch, 'merge'):
+            return self.send_response(HTTP_NOT_FOUND, 'Sketch can\'t merge')
+        length = self.get_content_length()
+        if length > sketch_sync.max_delta_size(sketch.ring_size):
+            return self.send_response(HTTP_TOO_LARGE, 'Delta too large')
+        try:
+            sketch_sync.merge(sketch, origin, self.rfile.read(length))
+        except ValueError:
+            return self.send_response(HTTP_BAD_REQUEST, 'Bad delta')
+        self.send_response(HTTP_OK)
+        self.end_headers()
+
     def do_POST(self):
         "Handle POST requests"
         try:
-            if self.get_command() != 'add':
-                return self.send_response(HTTP_NOT_FOUND, 'Unknown command')
-            password = self.get_post_password()
-            hash = self.get_post_hash()
-            if not (password or hash):
-                return self.send_response(HTTP_NOT_FOUND, 'Missing password')
-
-            self.send_response(HTTP_CREATED)
-            self.end_headers()
-            self.server.sketch.add(password or hash)
+            function = {'add': self.post_add,
+                        'claim': self.post_claim,
+                        'merge': self.post_merge,
+                        'snapshot': self.post_snapshot}.get(self.get_command())
+            self.get_sketch()
         except BadPrefix:
             return self.send_response(HTTP_NOT_FOUND, 'Bad Prefix')
+        if not function:
+            return self.send_response(HTTP_NOT_FOUND, 'Unknown command')
+        try:
+            self.capture('POST')
+            function()
+        except BadArgument:
+            return self.send_response(HTTP_BAD_REQUEST, 'Bad argument')
         
 
 class PasswordOracleServer(BaseHTTPServer.HTTPServer):
@@ -323,6 +775,11 @@ class PasswordOracleServer(BaseHTTPServer.HTTPServer):
     An HTTPServer that preloads a deprecating sketch and optionally a static language model. 
     
     The deprecating hash is saved on SIGTERM or Ctrl-C
+
+    Once start_workers is called, accepted HTTP requests wait in a
+    bounded queue for a pool of worker threads instead of being
+    answered one at a time, so a flood of requests is turned away
+    with a quick 503 rather than making every caller wait.
     """
     
     @staticmethod 
@@ -344,19 +801,152 @@ class PasswordOracleServer(BaseHTTPServer.HTTPServer):
                 pass
         return default_class()
 
+    sketch_classes = {'deprecating': deprecating_sketch.DeprecatingSketch,
+                      'blocked': blocked_sketch.BlockedDeprecatingSketch,
+                      'generational': generational_sketch.GenerationalSketch}
+
     @classmethod
-    def sketch_factory(cls, sketch_path):
-        """Load the current deprecating sketch."""
-        return cls.load(sketch_path, deprecating_sketch.DeprecatingSketch)
+    def sketch_factory(cls, sketch_path, **options):
+        """Load a sketch of the kind chosen by GFLAGS.sketch.
+
+        A sketch of another kind or shape is thrown away and replaced
+        by an empty one.
+
+        Args:
+          sketch_path: The pathname of the sketch.
+          options: Constructor arguments (slots, items, ...) to use
+            instead of the flags of the same name.
+        """
+        sketch_class = cls.sketch_classes[GFLAGS.sketch]
+        parameters = dict((name, options.get(name, getattr(GFLAGS, name)))
+                          for name in sketch_class.parameters)
+        sketch = cls.load(sketch_path, lambda: sketch_class(**parameters))
+        if type(sketch) is not sketch_class or sketch.parameters_changed(**parameters):
+            print >>sys.stderr, "Parameters changed, bloomfilter wiped, password history lost"
+            sketch = sketch_class(**parameters)
+        if isinstance(sketch, deprecating_sketch.DeprecatingSketch):
+            sketch.set_counter_bits(int(GFLAGS.counter_bits))
+        return sketch
     
     @classmethod
     def language_model_factory(cls, language_model_path):
         """Load the language_model.  Decompress it with gzip."""
         return cls.load(language_model_path, language_model.LanguageModel, open=gzip.open)
 
+    def write_sketches(self):
+        """Write every sketch to its file.
+
+        Each is written to a temporary file and renamed over the old
+        one, so a crash part way through never leaves a truncated
+        sketch behind.
+        """
+        for name, sketch in self.sketches.items():
+            path = self.sketch_paths[name]
+            temporary = '%s.%d.tmp' % (path, os.getpid())
+            with open(temporary, "wb") as f:
+                cPickle.dump(sketch, f, cPickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(temporary, path)
+
     def save(self, *_):
-        """Save the current deprecating sketch."""
-        cPickle.dump(self.sketch, open(self.sketch_path, "w+"))
+        """Save the current deprecating sketch and those of every namespace."""
+        self.reap_snapshot(wait=True)
+        self.write_sketches()
+        if self.traffic_log:
+            self.traffic_log.flush()
+
+    def snapshot(self):
+        """Start saving the sketches in the background.
+
+        A forked child writes its copy-on-write view of the sketches
+        while this process goes on serving.  The sketch locks are held
+        across the fork so the child never sees a half finished add.
+        The child times the write itself and sends the duration back
+        through a pipe, so it doesn't depend on when the child is
+        reaped.
+
+        Returns:
+          False if a snapshot is already running, True otherwise.
+        """
+        with self.snapshot_lock:
+            self.reap_snapshot()
+            if self.snapshot_pid:
+                return False
+            if self.traffic_log:
+                self.traffic_log.flush()
+            locks = [sketch.lock for sketch in self.sketches.values()]
+            reader, writer = os.pipe()
+            for lock in locks:
+                lock.acquire()
+            try:
+                pid = os.fork()
+                if pid == 0:
+                    status = 1
+                    started = time.time()
+                    try:
+                        self.write_sketches()
+                        status = 0
+                    except Exception, ex:
+                        print >>sys.stderr, "Snapshot failed: %s" % ex
+                    finally:
+                        os.write(writer, repr(time.time() - started))
+                        os._exit(status)
+            except OSError:
+                os.close(reader)
+                raise
+            finally:
+                os.close(writer)
+                for lock in locks:
+                    lock.release()
+            self.snapshot_pid = pid
+            self.snapshot_pipe = reader
+            self.snapshot_started = time.time()
+            return True
+
+    def reap_snapshot(self, wait=False):
+        """Collect a finished snapshot child and record how it went.
+
+        Args:
+          wait: Block until the running snapshot (if any) finishes.
+        """
+        with self.snapshot_lock:
+            if not self.snapshot_pid:
+                return
+            pid, status = os.waitpid(self.snapshot_pid, not wait and os.WNOHANG or 0)
+            if not pid:
+                return
+            self.snapshot_pid = None
+            try:
+                self.snapshot_duration = float(os.read(self.snapshot_pipe, 64))
+            except ValueError:
+                self.snapshot_duration = None
+            os.close(self.snapshot_pipe)
+            if status == 0:
+                self.snapshot_taken = self.snapshot_started
+            else:
+                self.snapshot_failures += 1
+
+    def snapshot_if_due(self, interval):
+        "Start a snapshot if the last one began at least interval seconds ago."
+        self.reap_snapshot()
+        if time.time() - (self.snapshot_started or self.started) >= interval:
+            self.snapshot()
+
+    def snapshot_status(self):
+        """Describe the background snapshots for monitoring.
+
+        Returns:
+          dict(in_progress=bool,
+               age=seconds since the data in the newest snapshot was taken,
+               duration=seconds the last snapshot took,
+               failures=number of snapshots that failed)
+        """
+        self.reap_snapshot()
+        return dict(in_progress=bool(self.snapshot_pid),
+                    age=self.snapshot_taken and time.time() - self.snapshot_taken,
+                    duration=self.snapshot_duration,
+                    failures=self.snapshot_failures)
 
     def __init__(self, sketch_path, language_model_path=None, *args, **kwargs):
         """Create a new instance of the PasswordOracleServer.
@@ -375,19 +965,160 @@ class PasswordOracleServer(BaseHTTPServer.HTTPServer):
         self.language_model = self.language_model_factory(language_model_path)
 
         self.sketch_path = sketch_path
+        self.sketches = {'': self.sketch}
+        self.sketch_paths = {'': sketch_path}
+        self.listeners = []
+
+        self.started = time.time()
+        self.snapshot_lock = threading.RLock()
+        self.snapshot_pid = self.snapshot_pipe = None
+        self.snapshot_started = self.snapshot_taken = self.snapshot_duration = None
+        self.snapshot_failures = 0
+
+        self.accepted_origins = frozenset()
+        self.queue = None
+        self.admission_lock = threading.Lock()
+        self.refused = self.expired = 0
+        self.traffic_log = None
 
-    def run_forever(self):
+    def start_workers(self, count, queue_size=64, deadline=1.0, retry_after=1):
+        """Answer HTTP requests from a bounded queue with count threads.
+
+        Args:
+          count: The number of worker threads.
+          queue_size: How many requests may wait for a worker.  Cheap
+            requests (available, add, claim, ...) may fill all of it,
+            entropy scoring only half, and cheap requests are always
+            answered first.
+          deadline: Seconds from accepting a request to answering it.
+          retry_after: Seconds to ask refused clients to wait.
+        """
+        self.queue = Queue.PriorityQueue()
+        self.queue_size = queue_size
+        self.deadline = deadline
+        self.retry_after = retry_after
+        self.sequence = itertools.count()
+        for _ in range(count):
+            worker = threading.Thread(target=self.work)
+            worker.setDaemon(True)
+            worker.start()
+
+    def process_request(self, request, client_address):
+        self.admit(self, request, client_address)
+
+    def admit(self, server, request, client_address):
+        """Queue an accepted request for the workers, or refuse it.
+
+        Args:
+          server: The server (this one or a PasswordOracleListener)
+            that accepted the request.
+        """
+        if self.queue is None:
+            return SocketServer.BaseServer.process_request(server, request, client_address)
+        priority = request_priority(request)
+        limit = self.queue_size
+        if priority == PRIORITY_EXPENSIVE:
+            limit //= 2
+        if self.queue.qsize() >= limit:
+            with self.admission_lock:
+                self.refused += 1
+            return self.refuse(server, request)
+        self.queue.put((priority, next(self.sequence), time.time(),
+                        server, request, client_address))
+
+    def refuse(self, server, request):
+        "Answer 503 without reading the request, and hang up."
+        try:
+            request.sendall(OVERLOADED % self.retry_after)
+            # Hanging up on unread data resets the connection, which
+            # can destroy the answer before the client reads it.
+            request.recv(2 ** 16, socket.MSG_DONTWAIT)
+        except socket.error:
+            pass
+        server.shutdown_request(request)
+
+    def serve_queued(self):
+        "Answer the most urgent queued request, waiting for one if need be."
+        priority, _, accepted, server, request, client_address = self.queue.get()
+        remaining = accepted + self.deadline - time.time()
+        if remaining <= 0:
+            with self.admission_lock:
+                self.expired += 1
+            return self.refuse(server, request)
+        try:
+            server.finish_request(DeadlineSocket(request, accepted + self.deadline,
+                                                 self.deadline),
+                                  client_address)
+        except Exception:
+            server.handle_error(request, client_address)
+        server.shutdown_request(request)
+
+    def work(self):
+        while True:
+            self.serve_queued()
+
+    def admission_status(self):
+        """Describe the request queue for monitoring.
+
+        Returns:
+          dict(queued=requests waiting for a worker,
+               refused=requests turned away because the queue was full,
+               expired=requests turned away after waiting too long)
+        """
+        return dict(queued=self.queue and self.queue.qsize() or 0,
+                    refused=self.refused,
+                    expired=self.expired)
+
+    def add_namespace(self, name, sketch_path, **options):
+        """Serve another, independent sketch under PREFIX/name/.
+
+        Args:
+          name: The namespace's URL path segment.
+          sketch_path: Where the namespace's sketch is kept.
+          options: Constructor arguments for the sketch, see sketch_factory.
+        """
+        self.sketches[name] = self.sketch_factory(sketch_path, **options)
+        self.sketch_paths[name] = sketch_path
+
+    def add_listener(self, listener):
+        """Serve another SocketServer from this server's loop.
+
+        The listener is expected to reach this server's sketch itself,
+        i.e. a sketch_protocol.SketchProtocolServer built around self.
+        """
+        self.listeners.append(listener)
+
+    def handle_requests(self, timeout=None):
+        """Wait for and handle one round of requests on every listener."""
+        readable, _, _ = select.select([self] + self.listeners, [], [], timeout)
+        for server in readable:
+            server._handle_request_noblock()
+
+    def run_forever(self, snapshot_interval=0):
         """Run this service for ever.
 
         Catches and saves the deprecating sketch state on
         KeyboardInterrupt and signal.SIGTERM.
+
+        A finished snapshot (see snapshot) is reaped, and the traffic
+        log (if any) flushed, within about a second, whether or not
+        snapshots are on a schedule.
+
+        Args:
+          snapshot_interval: If set, also save the sketches in the
+            background every snapshot_interval seconds.
         """
-        import select 
         signal.signal(signal.SIGTERM, self.save)
+        timeout = min(snapshot_interval or 1, 1)
         try:
             while True:
                 try:
-                    self.handle_request()
+                    self.handle_requests(timeout)
+                    self.reap_snapshot()
+                    if self.traffic_log:
+                        self.traffic_log.flush_if_due()
+                    if snapshot_interval:
+                        self.snapshot_if_due(snapshot_interval)
                 except select.error, err:
                     # Side effect of signal catching ... 
                     if (err[0], err[1]) != (ERR_INTERRUPTED, 'Interrupted system call'):
@@ -395,17 +1126,108 @@ class PasswordOracleServer(BaseHTTPServer.HTTPServer):
         except KeyboardInterrupt:
             self.save()
 
+class UnixPasswordOracleServer(utils.UnixStreamServerMixin, PasswordOracleServer):
+    "A PasswordOracleServer listening to a Unix domain socket instead of TCP."
+
+
+class PasswordOracleListener(BaseHTTPServer.HTTPServer):
+    """An additional HTTP listener for a PasswordOracleServer.
+
+    Attributes it doesn't have itself (sketch, language_model, ...)
+    are looked up on the oracle, so request handlers can't tell the
+    difference.
+    """
+
+    def __init__(self, oracle, *args, **kwargs):
+        self.oracle = oracle
+        BaseHTTPServer.HTTPServer.__init__(self, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.oracle, name)
+
+    def process_request(self, request, client_address):
+        self.oracle.admit(self, request, client_address)
+
+
+class UnixPasswordOracleListener(utils.UnixStreamServerMixin, PasswordOracleListener):
+    "A PasswordOracleListener listening to a Unix domain socket."
+
+
+class UnixSketchProtocolServer(utils.UnixStreamServerMixin, 
+                               sketch_protocol.SketchProtocolServer):
+    "A SketchProtocolServer listening to a Unix domain socket."
+
+
+def unix_socket(factory, *args, **kwargs):
+    """Construct a Unix domain socket server with GFLAGS.unix_socket_mode.
+
+    The umask is narrowed while the server binds rather than chmoding
+    afterwards, so there is no window in which the socket is more
+    open than requested.
+    """
+    umask = os.umask(0777 & ~int(GFLAGS.unix_socket_mode, 8))
+    try:
+        return factory(*args, **kwargs)
+    finally:
+        os.umask(umask)
+
+
 def main(argv):
     try:
         argv = GFLAGS(argv)  # parse flags
     except gflags.FlagsError, e:
         print '%s\nUsage: %s ARGS\n%s' % (e, sys.argv[0], GFLAGS)
         sys.exit(1)
-    server_address = (GFLAGS.host, GFLAGS.port)
-    PasswordOracleServer(GFLAGS.language_model, 
-                         GFLAGS.bloom_filter, 
-                         server_address, 
-                         PasswordOracleRequestHandler).run_forever()
+    if GFLAGS.port:
+        server = PasswordOracleServer(GFLAGS.bloom_filter, 
+                                      GFLAGS.language_model, 
+                                      (GFLAGS.host, GFLAGS.port), 
+                                      PasswordOracleRequestHandler)
+        if GFLAGS.unix_socket:
+            server.add_listener(unix_socket(UnixPasswordOracleListener, 
+                                            server, 
+                                            GFLAGS.unix_socket, 
+                                            PasswordOracleRequestHandler))
+    elif GFLAGS.unix_socket:
+        server = unix_socket(UnixPasswordOracleServer, 
+                             GFLAGS.bloom_filter, 
+                             GFLAGS.language_model, 
+                             GFLAGS.unix_socket, 
+                             PasswordOracleRequestHandler)
+    else:
+        print 'One of --port or --unix_socket is required\nUsage: %s ARGS\n%s' % (
+            sys.argv[0], GFLAGS)
+        sys.exit(1)
+
+    for spec in GFLAGS.namespace:
+        try:
+            name, options = parse_namespace(spec)
+        except ValueError, e:
+            print '%s\nUsage: %s ARGS\n%s' % (e, sys.argv[0], GFLAGS)
+            sys.exit(1)
+        root, extension = os.path.splitext(GFLAGS.bloom_filter)
+        server.add_namespace(name, 
+                             options.pop('bloom_filter', '%s.%s%s' % (root, name, extension)), 
+                             **options)
+
+    server.accepted_origins = frozenset(GFLAGS.accept_origin)
+    if GFLAGS.peer:
+        sketch_sync.PeerSync(server, GFLAGS.peer, 
+                             GFLAGS.origin or '%s:%d' % (socket.gethostname(), GFLAGS.port), 
+                             GFLAGS.sync_interval).start()
+    if GFLAGS.capture:
+        server.traffic_log = traffic_log.TrafficLog(open(GFLAGS.capture, 'ab'))
+    if GFLAGS.workers:
+        server.start_workers(GFLAGS.workers, GFLAGS.queue_size, 
+                             GFLAGS.deadline, GFLAGS.retry_after)
+    if GFLAGS.protocol_port:
+        server.add_listener(sketch_protocol.SketchProtocolServer(
+                server, (GFLAGS.host, GFLAGS.protocol_port)))
+    if GFLAGS.protocol_unix_socket:
+        server.add_listener(unix_socket(UnixSketchProtocolServer, 
+                                        server, 
+                                        GFLAGS.protocol_unix_socket))
+    server.run_forever(GFLAGS.snapshot_interval)
 
 
 if __name__ == "__main__":
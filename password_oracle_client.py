@@ -0,0 +1,339 @@
+#!/usr/bin/env python2.6
+
+"""password_oracle_client
+
+A client for password_oracle.py that does the fiddly parts for you:
+
+* Passwords are hashed locally with exactly the function the server's
+  DeprecatingSketch uses, so clear text never leaves your process
+  unless you ask for an entropy score.
+
+* hash_range is fetched once and cached.
+
+* Connections are kept in a pool and reused.  If the server runs
+  with --protocol_port (or --protocol_unix_socket) checks go over the
+  binary protocol in sketch_protocol.py, where a batch of passwords
+  is a single pipelined frame; otherwise the HTTP API is used.
+
+* Every call has a timeout, and calls that are safe to repeat
+  (available, hash_range, entropy) are retried on connection errors.
+  add and claim are never retried: a second attempt could add the
+  password twice.
+
+Example:
+
+>>> client = PasswordOracleClient(http_address=('127.0.0.1', 8000),
+...                               protocol_address=('127.0.0.1', 8001))
+>>> client.available('123456')
+True
+>>> client.add('123456')
+>>> client.available_many(['123456', 'correct horse'])
+[False, True]
+"""
+
+import Queue
+import deprecating_sketch
+import httplib
+import json
+import socket
+import sketch_protocol
+import urllib
+
+
+class PasswordOracleError(Exception):
+    "Raised when the oracle answers with an error."
+
+
+class ConnectionPool:
+    """A pool of reusable connections.
+
+    Connections are created on demand by factory and at most size idle
+    connections are kept around.
+    """
+
+    def __init__(self, factory, size=4):
+        self.factory = factory
+        self.idle = Queue.LifoQueue(size)
+
+    def get(self):
+        try:
+            return self.idle.get_nowait()
+        except Queue.Empty:
+            return self.factory()
+
+    def put(self, connection):
+        try:
+            self.idle.put_nowait(connection)
+        except Queue.Full:
+            connection.close()
+
+    def call(self, function, retries=0):
+        """Call function(connection) with a pooled connection.
+
+        A connection that fails is closed rather than returned to the
+        pool, and the call is repeated on a fresh connection up to
+        retries more times.  An error answer from the oracle is
+        raised as it is, and its connection, having been read to the
+        end, goes back to the pool.
+        """
+        while True:
+            connection = self.get()
+            try:
+                result = function(connection)
+            except (socket.error, httplib.HTTPException):
+                connection.close()
+                if retries <= 0:
+                    raise
+                retries -= 1
+                continue
+            except PasswordOracleError:
+                self.put(connection)
+                raise
+            except Exception:
+                connection.close()
+                raise
+            self.put(connection)
+            return result
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    "An HTTPConnection to a server on a Unix domain socket (--unix_socket)."
+
+    def __init__(self, path, timeout=None):
+        httplib.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class ProtocolConnection:
+    "A connection speaking the binary protocol in sketch_protocol.py."
+
+    def __init__(self, address, timeout=None, namespace=''):
+        if isinstance(address, str):
+            self.socket = socket.socket(socket.AF_UNIX)
+            self.socket.settimeout(timeout)
+            self.socket.connect(address)
+        else:
+            self.socket = socket.create_connection(address, timeout)
+        self.buffered = ''
+        if namespace:
+            self.request([(sketch_protocol.NAMESPACE, namespace)])
+
+    def request(self, frames):
+        """Send a list of (opcode, payload) frames in one go.
+
+        Returns:
+          The list of response payloads, in order.
+
+        Raises:
+          PasswordOracleError if any frame was rejected.
+        """
+        self.socket.sendall(''.join(
+                sketch_protocol.encode_frame(opcode, payload)
+                for opcode, payload in frames))
+        responses = []
+        while len(responses) < len(frames):
+            chunk = self.socket.recv(sketch_protocol.RECV_SIZE)
+            if not chunk:
+                raise socket.error('connection closed by the oracle')
+            decoded, self.buffered = sketch_protocol.decode_frames(self.buffered + chunk)
+            responses.extend(decoded)
+        for status, payload in responses:
+            if status != sketch_protocol.STATUS_OK:
+                raise PasswordOracleError('oracle returned status %d' % status)
+        return [payload for status, payload in responses]
+
+    def close(self):
+        self.socket.close()
+
+
+class PasswordOracleClient:
+    """A client for one password oracle.
+
+    Passwords and hashes can be mixed freely: strings are hashed
+    locally, integers are sent as they are.
+    """
+
+    # The most hashes sent in one binary protocol frame.
+    BATCH = (sketch_protocol.MAX_FRAME - 1) // sketch_protocol.HASH.size
+
+    def __init__(self, http_address=None, protocol_address=None, path='/',
+                 namespace='', timeout=1.0, retries=2, pool_size=4):
+        """Create a new PasswordOracleClient.
+
+        Args:
+          http_address: (host, port) or Unix domain socket pathname
+            of the HTTP API.  Needed for entropy, and for everything
+            else if there is no protocol_address.
+          protocol_address: (host, port) or Unix domain socket
+            pathname of the binary protocol listener.
+          path: The server's --path.
+          namespace: The server --namespace to use, or '' for its
+            default sketch.
+          timeout: Seconds to wait on the network before giving up.
+          retries: How many times to repeat a failed idempotent call.
+          pool_size: How many idle connections to keep.
+        """
+        if not (http_address or protocol_address):
+            raise ValueError('http_address or protocol_address is required')
+        self.path = namespace and '%s%s/' % (path, namespace) or path
+        self.retries = retries
+        self.http = self.protocol = None
+        if http_address:
+            if isinstance(http_address, str):
+                factory = lambda: UnixHTTPConnection(http_address, timeout)
+            else:
+                factory = lambda: httplib.HTTPConnection(*http_address, **dict(timeout=timeout))
+            self.http = ConnectionPool(factory, pool_size)
+        if protocol_address:
+            self.protocol = ConnectionPool(
+                lambda: ProtocolConnection(protocol_address, timeout, namespace), pool_size)
+        self.__hash_range = None
+
+    def get(self, command, retries=0, **query):
+        """Make a GET request to the HTTP API.
+
+        Returns:
+          The decoded JSON response.
+        """
+        url = self.path + command
+        if query:
+            url += '?' + urllib.urlencode(query)
+
+        def get(connection):
+            connection.request('GET', url)
+            response = connection.getresponse()
+            body = response.read()
+            if response.status != httplib.OK:
+                raise PasswordOracleError('%s returned %d' % (command, response.status))
+            return json.loads(body)
+        return self.http.call(get, retries)
+
+    def post(self, command, data):
+        """Make a POST request to the HTTP API with a JSON body.
+
+        Returns:
+          The decoded JSON response, or None if there isn't one.
+        """
+        url = self.path + command
+        body = json.dumps(data)
+
+        def post(connection):
+            connection.request('POST', url, body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            answer = response.read()
+            if response.status >= 300:
+                raise PasswordOracleError('%s returned %d' % (command, response.status))
+            if answer:
+                return json.loads(answer)
+        return self.http.call(post)
+
+    def protocol_request(self, opcode, payloads, retries=0):
+        "Pipeline a frame per payload over the binary protocol."
+        return self.protocol.call(
+            lambda connection: connection.request([(opcode, payload) for payload in payloads]),
+            retries)
+
+    @property
+    def hash_range(self):
+        "The server's hash_range, fetched on first use."
+        if self.__hash_range is None:
+            if self.protocol:
+                hash_range, = self.protocol_request(
+                    sketch_protocol.HASH_RANGE, [''], self.retries)
+                self.__hash_range = int(hash_range)
+            else:
+                self.__hash_range = int(self.get('hash_range.json', self.retries))
+            self.__hashfunc = deprecating_sketch.hash_function(self.__hash_range)
+        return self.__hash_range
+
+    def hash(self, password):
+        """Hash a password exactly as the server would.
+
+        Integers are taken to be hashes already and returned as is.
+        """
+        if isinstance(password, (int, long)):
+            return password
+        if isinstance(password, unicode):
+            password = password.encode('utf-8')
+        hash_range = self.hash_range
+        return int(self.__hashfunc(password).hexdigest(), 16) % hash_range
+
+    def batches(self, passwords):
+        "Hash passwords and split them into protocol sized payloads."
+        hashes = [self.hash(password) for password in passwords]
+        return [sketch_protocol.encode_hashes(hashes[offset:offset + self.BATCH])
+                for offset in range(0, len(hashes), self.BATCH)]
+
+    def available_many(self, passwords):
+        """Check a batch of passwords (or hashes.)
+
+        Returns:
+          A list with True for each password that is available.
+        """
+        if self.protocol:
+            return [flag == '\1' for flag in ''.join(self.protocol_request(
+                        sketch_protocol.CHECK, self.batches(passwords), self.retries))]
+        return [self.get('available.json', self.retries, hash=self.hash(password))
+                for password in passwords]
+
+    def available(self, password):
+        "Return True if password (or a hash) hasn't been used recently."
+        return self.available_many([password])[0]
+
+    def add_many(self, passwords):
+        "Add a batch of passwords (or hashes) to the oracle."
+        if self.protocol:
+            self.protocol_request(sketch_protocol.ADD, self.batches(passwords))
+        else:
+            for password in passwords:
+                self.post('add', dict(hash=self.hash(password)))
+
+    def add(self, password):
+        "Add a password (or hash) to the oracle."
+        self.add_many([password])
+
+    def claim_many(self, passwords):
+        """Add each of a batch of passwords (or hashes) if it is available.
+
+        Nothing can be added by anyone else between the check and the
+        add.
+
+        Returns:
+          A list with True for each password that was available, and
+          so has now been added.
+        """
+        if self.protocol:
+            return [flag == '\1' for flag in ''.join(self.protocol_request(
+                        sketch_protocol.CHECK_AND_ADD, self.batches(passwords)))]
+        return self.post('claim', dict(hashes=[self.hash(password) for password in passwords]))
+
+    def claim(self, password):
+        "Add password (or a hash) if it is available, returning whether it was."
+        return self.claim_many([password])[0]
+
+    def strong_enough(self, password, min_bits=None):
+        """Check a password for availability and at least min_bits of entropy.
+
+        min_bits defaults to the server's --min_bits.  Like entropy
+        this sends the password in clear text.
+
+        Returns:
+          dict(strong_enough=bool, available=bool)
+        """
+        query = dict(password=password)
+        if min_bits is not None:
+            query['min_bits'] = min_bits
+        return self.get('strong_enough.json', self.retries, **query)
+
+    def entropy(self, password):
+        """Score a password against the server's language model.
+
+        This is the one call that sends the password in clear text;
+        it has to, the score can't be computed from a hash.
+        """
+        return self.get('entropy.json', self.retries, password=password)
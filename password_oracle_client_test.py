@@ -0,0 +1,179 @@
+#!/usr/bin/env python2.6
+
+import deprecating_sketch
+import hashlib
+import httplib
+import language_model
+import password_oracle
+import sketch_protocol
+import socket
+import StringIO
+import threading
+import unittest
+from password_oracle_client import *
+
+
+class QuietHandler(password_oracle.PasswordOracleRequestHandler):
+    def path_prefix(self):
+        return '/'
+
+    def log_message(self, *args):
+        pass
+
+
+class DroppingHandler(QuietHandler):
+    "Hangs up without answering while server.drops is positive."
+
+    def handle(self):
+        if self.server.drops > 0:
+            self.server.drops -= 1
+            return
+        QuietHandler.handle(self)
+
+
+class PasswordOracleClientTest(unittest.TestCase):
+    def setUp(self):
+        self.server = password_oracle.PasswordOracleServer(
+            None, None, ('127.0.0.1', 0), DroppingHandler)
+        self.server.drops = 0
+        self.server.sketch = deprecating_sketch.DeprecatingSketch(
+            slots=1000, items=4, per_item=2)
+        self.server.language_model = language_model.compile(
+            StringIO.StringIO("aaa\naab\nabb\naaa"))
+        self.protocol = sketch_protocol.SketchProtocolServer(self.server, ('127.0.0.1', 0))
+        self.server.add_listener(self.protocol)
+        self.running = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.start()
+
+    def serve(self):
+        while self.running:
+            self.server.handle_requests(0.05)
+
+    def tearDown(self):
+        self.running = False
+        self.thread.join()
+        self.server.server_close()
+        self.protocol.server_close()
+
+    def http_client(self):
+        return PasswordOracleClient(http_address=self.server.server_address)
+
+    def protocol_client(self):
+        return PasswordOracleClient(http_address=self.server.server_address,
+                                    protocol_address=self.protocol.server_address)
+
+    def test_hash_matches_server(self):
+        client = self.protocol_client()
+        self.assertEquals(client.hash_range, 1000 ** 2)
+        self.assertEquals(client.hash('secret'),
+                          int(hashlib.md5('secret').hexdigest(), 16) % 1000 ** 2)
+        self.assertEquals(list(self.server.sketch.hashes(client.hash('secret'))),
+                          list(self.server.sketch.hashes('secret')))
+
+    def test_hash_passes_integers_through(self):
+        self.assertEquals(self.http_client().hash(42), 42)
+
+    def test_protocol_round_trip(self):
+        client = self.protocol_client()
+        self.assertEquals(client.available_many(['secret', 'other']), [True, True])
+        client.add('secret')
+        self.assertEquals(client.available_many(['secret', 'other']), [False, True])
+        self.assertTrue('secret' in self.server.sketch)
+
+    def test_http_round_trip(self):
+        client = self.http_client()
+        self.assertTrue(client.available('secret'))
+        client.add('secret')
+        self.assertFalse(client.available('secret'))
+        self.assertTrue('secret' in self.server.sketch)
+
+    def test_protocol_claim(self):
+        client = self.protocol_client()
+        self.assertEquals(client.claim_many(['secret', 'other', 'secret']),
+                          [True, True, False])
+        self.assertFalse(client.claim('other'))
+
+    def test_http_claim(self):
+        client = self.http_client()
+        self.assertTrue(client.claim('secret'))
+        self.assertEquals(client.claim_many(['secret', 'other']), [False, True])
+        self.assertFalse(client.available('other'))
+
+    def test_namespace(self):
+        admin = deprecating_sketch.DeprecatingSketch(slots=10, items=2, per_item=1)
+        self.server.sketches['admin'] = admin
+        for client in [PasswordOracleClient(http_address=self.server.server_address,
+                                            namespace='admin'),
+                       PasswordOracleClient(protocol_address=self.protocol.server_address,
+                                            namespace='admin')]:
+            self.assertEquals(client.hash_range, 10)
+            client.add(3)
+            self.assertFalse(client.available(3))
+        self.assertTrue(3 in admin)
+        self.assertFalse(3 in self.server.sketch)
+
+    def test_entropy(self):
+        self.assertAlmostEquals(self.http_client().entropy('aaa'), 2.0)
+
+    def test_strong_enough(self):
+        self.assertEquals(self.http_client().strong_enough('aab', 3),
+                          dict(strong_enough=True, available=True))
+
+    def test_connections_are_reused(self):
+        client = self.protocol_client()
+        client.available('secret')
+        connection = client.protocol.get()
+        client.protocol.put(connection)
+        client.available('secret')
+        self.assertTrue(client.protocol.get() is connection)
+
+    def test_idempotent_calls_retried(self):
+        client = self.http_client()
+        self.server.drops = 2
+        self.assertTrue(client.available('secret'))
+        self.assertEquals(self.server.drops, 0)
+
+    def test_retries_give_up(self):
+        client = self.http_client()
+        client.hash_range
+        self.server.drops = 3
+        self.assertRaises((socket.error, httplib.HTTPException), client.available, 'secret')
+        self.assertEquals(self.server.drops, 0)
+
+    def test_add_and_claim_not_retried(self):
+        client = self.http_client()
+        client.hash_range
+        for call in (client.add, client.claim):
+            self.server.drops = 1
+            self.assertRaises((socket.error, httplib.HTTPException), call, 'secret')
+            self.assertFalse('secret' in self.server.sketch)
+        client.add('secret')
+        self.assertTrue('secret' in self.server.sketch)
+
+    def test_error_answer_keeps_connection(self):
+        client = self.http_client()
+        self.assertRaises(PasswordOracleError, client.get, 'nonsense.json')
+        self.assertEquals(client.http.idle.qsize(), 1)
+        client = self.protocol_client()
+        self.assertRaises(PasswordOracleError, client.protocol_request,
+                          sketch_protocol.CHECK, ['\0'])
+        self.assertEquals(client.protocol.idle.qsize(), 1)
+
+    def test_timeout(self):
+        silent = socket.socket()
+        silent.bind(('127.0.0.1', 0))
+        silent.listen(1)
+        try:
+            client = PasswordOracleClient(http_address=silent.getsockname(),
+                                          timeout=0.05, retries=0)
+            self.assertRaises(socket.timeout, client.available, 'secret')
+        finally:
+            silent.close()
+
+    def test_requires_an_address(self):
+        self.assertRaises(ValueError, PasswordOracleClient)
+
+
+if __name__ == "__main__":
+    unittest.main()
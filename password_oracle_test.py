@@ -1,5 +1,13 @@
 #!/usr/bin/env python2.6 
 
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 import deprecating_sketch
 import language_model 
@@ -12,6 +20,7 @@ class FakeServer:
     def __init__(self, sketch, language_model):
         self.sketch = sketch
         self.language_model = language_model 
+        self.traffic_log = None
         
 
 class PasswordOracleRequestHandlerCrashDummy(PasswordOracleRequestHandler):
@@ -77,12 +86,182 @@ class PasswordOracleRequestHandlerTest(unittest.TestCase):
         self.assertAlmostEqual(actual['entropy'], 2.00)
         self.assertEqual(actual['available'], True)
 
+    def test_strong_enough(self):
+        self.handler.server.sketch.add("aab")
+        self.handler.path = PREFIX + "strong_enough.json?password=aab&min_bits=3"
+        self.handler.do_GET()
+        self.assertEqual(json.loads(self.handler.wfile.getvalue()),
+                         dict(strong_enough=True, available=False))
+
+    def test_not_strong_enough(self):
+        self.handler.path = PREFIX + "strong_enough.json?password=aaa&min_bits=2.5"
+        self.handler.do_GET()
+        self.assertEqual(json.loads(self.handler.wfile.getvalue()),
+                         dict(strong_enough=False, available=True))
+
+    def test_strong_enough_bad_min_bits(self):
+        self.handler.path = PREFIX + "strong_enough.json?password=aaa&min_bits=lots"
+        self.handler.do_GET()
+        self.assertEquals(self.handler.response_code[0], 400)
+
     def test_get_bits_required(self):
         self.handler.path = PREFIX + "hash_range.json?password"
         self.handler.do_GET()
         actual = json.loads(self.handler.wfile.getvalue())
         self.assertEqual(actual, 1000)
 
+class NamespaceTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = PasswordOracleRequestHandlerCrashDummy(
+            deprecating_sketch.DeprecatingSketch(slots=1000, items=2, per_item=1),
+            language_model.compile(StringIO.StringIO("aaa\naab\nabb\naaa")))
+        self.admin = deprecating_sketch.DeprecatingSketch(slots=10, items=2, per_item=1)
+        self.handler.server.sketches = {'admin': self.admin}
+
+    def test_split_command(self):
+        self.handler.path = PREFIX + "admin/available.json?password=aaa"
+        self.assertEquals(self.handler.split_command(), ('admin', 'available.json'))
+        self.assertTrue(self.handler.get_sketch() is self.admin)
+
+    def test_namespaced_hash_range(self):
+        self.handler.path = PREFIX + "admin/hash_range.json"
+        self.handler.do_GET()
+        self.assertEquals(json.loads(self.handler.wfile.getvalue()), 10)
+
+    def test_namespaced_add(self):
+        self.handler.path = PREFIX + "admin/add"
+        self.handler.test_password = 'secret'
+        self.handler.do_POST()
+        self.assertEquals(self.handler.response_code[0], 201)
+        self.assertTrue('secret' in self.admin)
+        self.assertFalse('secret' in self.handler.server.sketch)
+
+    def test_unknown_namespace(self):
+        self.handler.path = PREFIX + "other/available.json?password=aaa"
+        self.handler.do_GET()
+        self.assertEquals(self.handler.response_code[0], 404)
+
+    def test_parse_namespace(self):
+        self.assertEquals(parse_namespace('admin'), ('admin', {}))
+        self.assertEquals(parse_namespace('api:slots=4096:per_item=1:bloom_filter=api.pickle'),
+                          ('api', dict(slots=4096, per_item=1, bloom_filter='api.pickle')))
+        self.assertRaises(ValueError, parse_namespace, 'a/b')
+        self.assertRaises(ValueError, parse_namespace, 'api:colour=blue')
+
+
+class RequestDecodingTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = PasswordOracleRequestHandlerCrashDummy(
+            deprecating_sketch.DeprecatingSketch(slots=1000, items=2, per_item=1),
+            language_model.compile(StringIO.StringIO("aaa\naab\nabb\naaa")))
+
+    def post(self, content_type, body):
+        self.handler.headers = {'Content-Type': content_type,
+                                'Content-Length': str(len(body))}
+        self.handler.rfile = StringIO.StringIO(body)
+
+    def test_path_parsed_once(self):
+        self.handler.path = PREFIX + "all.json?password=aaa&hash=7"
+        self.assertEquals(self.handler.get_query(), dict(password="aaa", hash="7"))
+        self.assertTrue(self.handler.get_query() is self.handler.get_query())
+        self.assertEquals(self.handler.get_command(), "all.json")
+
+    def test_new_path_reparsed(self):
+        self.handler.path = PREFIX + "available.json?password=aaa"
+        self.assertEquals(self.handler.get_password(), "aaa")
+        self.handler.path = PREFIX + "available.json?hash=3"
+        self.assertEquals(self.handler.get_password(), None)
+        self.assertEquals(self.handler.get_hash(), 3)
+
+    def test_urlencoded_post(self):
+        self.post('application/x-www-form-urlencoded', 'password=secret')
+        self.assertEquals(PasswordOracleRequestHandler.get_post_password(self.handler),
+                          'secret')
+        self.assertEquals(PasswordOracleRequestHandler.get_post_hash(self.handler),
+                          None)
+
+    def test_json_post(self):
+        self.post('application/json; charset=utf-8', '{"hash": 42}')
+        self.assertEquals(PasswordOracleRequestHandler.get_post_hash(self.handler),
+                          42)
+
+    def test_malformed_json_post(self):
+        self.post('application/json', '{"hash": ')
+        self.assertRaises(BadArgument, PasswordOracleRequestHandler.get_post_data,
+                          self.handler)
+        self.handler.path = PREFIX + "claim"
+        self.handler.do_POST()
+        self.assertEquals(self.handler.response_code[0], 400)
+
+    def test_bad_hash(self):
+        self.handler.path = PREFIX + "available.json?hash=xyz"
+        self.assertRaises(BadArgument, self.handler.get_hash)
+        self.handler.do_GET()
+        self.assertEquals(self.handler.response_code[0], 400)
+
+    def test_bad_content_length(self):
+        self.post('application/json', '{}')
+        self.handler.headers['Content-Length'] = 'many'
+        self.handler.path = PREFIX + "claim"
+        self.handler.do_POST()
+        self.assertEquals(self.handler.response_code[0], 400)
+
+    def test_json_post_bad_hash(self):
+        self.post('application/json', '{"hash": "x"}')
+        self.assertRaises(BadArgument, PasswordOracleRequestHandler.get_post_hash,
+                          self.handler)
+
+    def test_json_password_is_bytes(self):
+        self.post('application/json', '{"password": "secret"}')
+        self.assertEquals(type(PasswordOracleRequestHandler.get_post_password(self.handler)),
+                          str)
+
+
+class CaptureTest(RequestDecodingTest):
+    def setUp(self):
+        RequestDecodingTest.setUp(self)
+        self.log = StringIO.StringIO()
+        self.handler.server.traffic_log = traffic_log.TrafficLog(self.log, key='test')
+
+    def records(self):
+        return list(traffic_log.read_records(StringIO.StringIO(self.log.getvalue())))
+
+    def test_get_captured(self):
+        self.handler.path = PREFIX + "entropy.json?password=secret"
+        self.handler.do_GET()
+        record, = self.records()
+        self.assertEquals((record.method, record.command, record.kind, record.length),
+                          ('GET', 'entropy', traffic_log.PASSWORD, 6))
+        self.assertFalse('secret' in self.log.getvalue())
+
+    def test_post_captured(self):
+        self.handler.path = PREFIX + "claim"
+        self.post('application/json', '{"hashes": [4, 5, 6]}')
+        self.handler.do_POST()
+        record, = self.records()
+        self.assertEquals((record.method, record.command, record.kind, record.length),
+                          ('POST', 'claim', traffic_log.HASHES, 3))
+
+    def test_unicode_batch_captured(self):
+        self.handler.path = PREFIX + "claim"
+        self.post('application/json', '{"passwords": ["p\\u00e4ss", "x"]}')
+        self.handler.do_POST()
+        self.assertEquals(json.loads(self.handler.wfile.getvalue()), [True, True])
+        self.assertEquals(len(self.records()), 1)
+
+    def test_capture_failure_still_answers(self):
+        self.handler.server.traffic_log.f = None
+        self.handler.path = PREFIX + "claim"
+        self.post('application/json', '{"hashes": [4]}')
+        self.handler.do_POST()
+        self.assertEquals(json.loads(self.handler.wfile.getvalue()), [True])
+
+    def test_unknown_commands_not_captured(self):
+        self.handler.path = PREFIX + "nonsense.json"
+        self.handler.do_GET()
+        self.assertEquals(self.records(), [])
+
+
 class PasswordOracleRequestHandlerComplexTest(unittest.TestCase):
     def setUp(self):
         self.sketch = deprecating_sketch.DeprecatingSketch(slots=100, items=2, per_item=1)
@@ -114,6 +293,54 @@ class PasswordOracleRequestHandlerComplexTest(unittest.TestCase):
         handler.do_GET()
         self.assertFalse(json.loads(handler.wfile.getvalue()))
 
+    def test_claim(self):
+        handler = self.handler
+        handler.path = PREFIX + "claim"
+        handler.test_password = 'secret'
+        handler.headers = {'Content-Type': 'application/x-www-form-urlencoded',
+                           'Content-Length': '0'}
+        handler.rfile = StringIO.StringIO()
+        handler.do_POST()
+        self.assertEquals(handler.response_code[0], 200)
+        self.assertEquals(json.loads(handler.wfile.getvalue()), True)
+
+        handler = PasswordOracleRequestHandlerCrashDummy(
+            self.sketch, 
+            language_model.compile(StringIO.StringIO("aaa\naab\nabb\naaa")))
+        handler.path = PREFIX + "claim"
+        body = '{"passwords": ["secret", "other"], "ignored": 1}'
+        handler.headers = {'Content-Type': 'application/json',
+                           'Content-Length': str(len(body))}
+        handler.rfile = StringIO.StringIO(body)
+        handler.do_POST()
+        self.assertEquals(json.loads(handler.wfile.getvalue()), [False, True])
+
+    def test_claim_hash_batch(self):
+        handler = self.handler
+        handler.path = PREFIX + "claim"
+        body = '{"hashes": [1, 2, 1]}'
+        handler.headers = {'Content-Type': 'application/json',
+                           'Content-Length': str(len(body))}
+        handler.rfile = StringIO.StringIO(body)
+        handler.do_POST()
+        self.assertEquals(json.loads(handler.wfile.getvalue()), [True, True, False])
+
+    def test_claim_bad_batch(self):
+        for body in ['{"passwords": [123]}', '{"hashes": ["x"]}', '{"hashes": [1.5]}']:
+            handler = PasswordOracleRequestHandlerCrashDummy(self.sketch, None)
+            handler.path = PREFIX + "claim"
+            handler.headers = {'Content-Type': 'application/json',
+                               'Content-Length': str(len(body))}
+            handler.rfile = StringIO.StringIO(body)
+            handler.do_POST()
+            self.assertEquals(handler.response_code[0], 400)
+        self.assertEquals(self.sketch.claim_many([123]), [True])
+
+    def test_post_unknown_command(self):
+        self.handler.path = PREFIX + "remove"
+        self.handler.do_POST()
+        self.assertEquals(self.handler.response_code[0], 404)
+
     def test_hashmode_writes_to_sketch(self):
         sketch = self.sketch
         handler = self.handler 
@@ -138,5 +365,228 @@ class PasswordOracleRequestHandlerComplexTest(unittest.TestCase):
         handler.do_GET()
         self.assertFalse(json.loads(handler.wfile.getvalue()))
 
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'sketch.pickle')
+        self.server = PasswordOracleServer(self.path, None, ('127.0.0.1', 0),
+                                           PasswordOracleRequestHandler)
+        self.server.sketch = self.server.sketches[''] = (
+            deprecating_sketch.DeprecatingSketch(slots=100, items=2, per_item=1))
+
+    def tearDown(self):
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def wait(self):
+        while self.server.snapshot_status()['in_progress']:
+            time.sleep(0.01)
+
+    def test_snapshot(self):
+        self.server.sketch.add('secret')
+        self.assertFalse(self.server.snapshot_status()['age'])
+        self.assertTrue(self.server.snapshot())
+        self.wait()
+        status = self.server.snapshot_status()
+        self.assertEquals(status['failures'], 0)
+        self.assertTrue(status['age'] >= 0)
+        self.assertTrue(status['duration'] >= 0)
+        self.assertEquals(cPickle.load(open(self.path)), self.server.sketch)
+        self.assertEquals(os.listdir(self.directory), ['sketch.pickle'])
+
+    def test_duration_measured_by_child(self):
+        self.server.snapshot()
+        time.sleep(0.5)
+        status = self.server.snapshot_status()
+        self.assertFalse(status['in_progress'])
+        self.assertTrue(0 <= status['duration'] < 0.25)
+
+    def test_snapshot_is_a_point_in_time(self):
+        self.server.snapshot()
+        self.server.sketch.add('secret')
+        self.wait()
+        self.assertFalse('secret' in cPickle.load(open(self.path)))
+
+    def test_one_snapshot_at_a_time(self):
+        self.server.snapshot()
+        self.assertFalse(self.server.snapshot())
+        self.server.save()
+        self.assertFalse(self.server.snapshot_status()['in_progress'])
+
+    def test_failed_snapshot_counted(self):
+        self.server.sketch_paths[''] = os.path.join(self.directory, 'missing', 'sketch.pickle')
+        self.server.snapshot()
+        self.wait()
+        self.assertEquals(self.server.snapshot_status()['failures'], 1)
+
+    def test_snapshot_if_due(self):
+        self.server.snapshot_if_due(3600)
+        self.assertFalse(self.server.snapshot_pid)
+        self.server.snapshot_if_due(0)
+        self.assertTrue(self.server.snapshot_pid)
+        self.wait()
+
+
+class LanguageModelFileTest(unittest.TestCase):
+    "Models written by language_model.py load into the server."
+
+    PASSWORDS = "password\n123456\nletmein\npassword1\nqwerty\n" * 20
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'language_model.pickle.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def compile(self, *flags):
+        "Run language_model.py with flags and gzip what it writes to self.path."
+        compiler = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                          'language_model.py')] + list(flags),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        model, _ = compiler.communicate(self.PASSWORDS)
+        self.assertEquals(compiler.returncode, 0)
+        with gzip.open(self.path, 'wb') as f:
+            f.write(model)
+        return PasswordOracleServer.language_model_factory(self.path)
+
+    def test_quantized(self):
+        model = self.compile('--prune_below=2', '--quantize=8')
+        self.assertTrue(isinstance(model['a', 's'], language_model.QuantizedHistogram))
+        self.assertTrue(model.bits('password') > 0)
+
+    def test_backoff(self):
+        model = self.compile('--orders=4')
+        self.assertTrue(isinstance(model, language_model.BackoffModel))
+        self.assertTrue(0 < model.bits('password') < model.bits('Xj9#kq'))
+
+
+class DeadlineSocketTest(unittest.TestCase):
+    def setUp(self):
+        self.server, self.client = socket.socketpair()
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+
+    def trickle(self):
+        for _ in range(10):
+            self.client.sendall('x')
+            time.sleep(0.05)
+
+    def test_slow_client_cut_off(self):
+        sender = threading.Thread(target=self.trickle)
+        sender.start()
+        started = time.time()
+        wrapped = DeadlineSocket(self.server, started + 0.2, 1.0)
+        self.assertRaises(socket.timeout, wrapped.makefile('rb').readline)
+        self.assertTrue(time.time() - started < 0.4)
+        sender.join()
+
+    def test_writes_after_deadline(self):
+        wrapped = DeadlineSocket(self.server, time.time() - 1, 1.0)
+        self.assertRaises(socket.timeout, wrapped.recv, 1)
+        wrapped.makefile('wb', 0).write('answer')
+        self.assertEquals(self.client.recv(100), 'answer')
+
+
+class QuietHandler(PasswordOracleRequestHandler):
+    def path_prefix(self):
+        return '/'
+
+    def log_message(self, *args):
+        pass
+
+
+class AdmissionTest(unittest.TestCase):
+    def setUp(self):
+        self.server = PasswordOracleServer(None, None, ('127.0.0.1', 0), QuietHandler)
+        self.server.sketch = self.server.sketches[''] = (
+            deprecating_sketch.DeprecatingSketch(slots=100, items=2, per_item=1))
+        self.server.start_workers(0, queue_size=4)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.server_close()
+
+    def connect(self, request_line):
+        "Connect, send a request, and have the server accept it."
+        client = socket.create_connection(self.server.server_address)
+        self.clients.append(client)
+        if request_line:
+            client.sendall(request_line + '\r\n\r\n')
+        self.server.handle_requests(1)
+        return client
+
+    def response(self, client):
+        data = ''
+        while True:
+            chunk = client.recv(4096)
+            if not chunk:
+                return data
+            data += chunk
+
+    def test_request_priority(self):
+        server, client = socket.socketpair()
+        try:
+            self.assertEquals(request_priority(server), PRIORITY_EXPENSIVE)
+            client.sendall('GET /admin/available.json?hash=3 HTTP/1.0\r\n')
+            self.assertEquals(request_priority(server), PRIORITY_CHEAP)
+            self.assertTrue(server.recv(100).startswith('GET /admin/available'))
+            client.sendall('GET /entropy.json?password=x HTTP/1.0\r\n')
+            self.assertEquals(request_priority(server), PRIORITY_EXPENSIVE)
+        finally:
+            server.close()
+            client.close()
+
+    def test_refused_when_full(self):
+        cheap = 'GET /available.json?hash=1 HTTP/1.0'
+        expensive = 'GET /entropy.json?password=x HTTP/1.0'
+        queued = [self.connect(cheap), self.connect(expensive)]
+        refused = self.connect(expensive)
+        response = self.response(refused)
+        self.assertTrue(response.startswith('HTTP/1.0 503'))
+        self.assertTrue('Retry-After: 1\r\n' in response)
+        queued += [self.connect(cheap), self.connect(cheap)]
+        self.assertTrue(self.response(self.connect(cheap)).startswith('HTTP/1.0 503'))
+        self.assertEquals(self.server.admission_status(),
+                          dict(queued=4, refused=2, expired=0))
+
+    def test_cheap_requests_first(self):
+        expensive = self.connect('GET /entropy.json?password=x HTTP/1.0')
+        cheap = self.connect('GET /available.json?hash=1 HTTP/1.0')
+        self.server.serve_queued()
+        self.assertTrue(self.response(cheap).endswith('\r\n\r\ntrue'))
+        self.server.serve_queued()
+        self.assertTrue(self.response(expensive).startswith('HTTP/1.0 503'))
+        self.assertEquals(self.server.admission_status()['expired'], 0)
+
+    def test_deadline(self):
+        self.server.deadline = 0
+        client = self.connect('GET /available.json?hash=1 HTTP/1.0')
+        self.server.serve_queued()
+        self.assertTrue(self.response(client).startswith('HTTP/1.0 503'))
+        self.assertEquals(self.server.admission_status()['expired'], 1)
+
+    def test_expired_counted_across_workers(self):
+        self.server.deadline = 0
+        clients = [self.connect('GET /available.json?hash=1 HTTP/1.0') for _ in range(4)]
+        workers = [threading.Thread(target=self.server.serve_queued) for _ in clients]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEquals(self.server.admission_status()['expired'], 4)
+
+    def test_workers(self):
+        self.server.start_workers(2)
+        clients = [self.connect('GET /available.json?hash=1 HTTP/1.0') for _ in range(3)]
+        for client in clients:
+            self.assertTrue(self.response(client).startswith('HTTP/1.0 200'))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python2.6
+
+"""replay_traffic
+
+Replays a traffic log captured with password_oracle.py --capture
+against a test server, keeping the original mix of commands and the
+original timing (or a multiple of it), and reports the latency of
+each command.
+
+# ./password_oracle.py --port=8100 --workers=8 --language_model=... &
+# ./replay_traffic.py --server=127.0.0.1:8100 --speed=2 < capture.log
+
+Requests are sent when they are due, whether or not earlier ones
+have been answered, so a burst in the log is a burst at the server.
+Latency is measured from when a request was due, so time spent
+waiting for one of the --connections counts too.  With --speed=0
+nothing is ever due: each request goes out as soon as a connection
+is free, and its latency is measured from then.
+
+The log holds fingerprints, not passwords, so each password is
+replaced by a made up one of the same length.  A password that was
+repeated in the log is repeated in the replay.  Hash values are
+fingerprints reduced by the server's hash_range.
+"""
+
+import Queue
+import collections
+import gflags
+import httplib
+import json
+import math
+import password_oracle_client
+import sys
+import threading
+import time
+import traffic_log
+import urllib
+
+GFLAGS = gflags.FLAGS
+
+gflags.DEFINE_string('server', '127.0.0.1:8000',
+                     'host:port, or Unix domain socket pathname, of the server to load.')
+gflags.DEFINE_string('prefix', '/', 'The server\'s --path.')
+gflags.DEFINE_string('input', '-', 'Traffic log to replay, - for stdin.')
+gflags.DEFINE_float('speed', 1.0,
+                    'Replay this many times faster than captured.  0 sends every '
+                    'request as soon as a connection is free.')
+gflags.DEFINE_integer('connections', 16, 'Requests that may be outstanding at once.')
+gflags.DEFINE_float('timeout', 10.0, 'Seconds to wait for each answer.')
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def synthetic_password(fingerprint, length):
+    "A made up password standing in for every password with this fingerprint."
+    return ('%016x' % fingerprint * (length // 16 + 1))[:length]
+
+
+def build_request(record, prefix, hash_range):
+    """Turn a log record back into an HTTP request.
+
+    Returns:
+      (method, url, body, headers)
+    """
+    url = prefix + record.command
+    if record.method == 'GET':
+        url += '.json'
+    arguments = {}
+    if record.kind == traffic_log.PASSWORD:
+        arguments['password'] = synthetic_password(record.fingerprint, record.length)
+    elif record.kind == traffic_log.HASH:
+        arguments['hash'] = record.fingerprint % hash_range
+    elif record.kind == traffic_log.PASSWORDS:
+        arguments['passwords'] = [synthetic_password(record.fingerprint + i, 12)
+                                  for i in range(record.length)]
+    elif record.kind == traffic_log.HASHES:
+        arguments['hashes'] = [(record.fingerprint + i) % hash_range
+                               for i in range(record.length)]
+    if record.method == 'GET':
+        if arguments:
+            url += '?' + urllib.urlencode(arguments)
+        return 'GET', url, None, {}
+    return 'POST', url, json.dumps(arguments), {'Content-Type': 'application/json'}
+
+
+def percentile(ordered, point):
+    "The nearest-rank percentile of an already sorted list."
+    if not ordered:
+        return None
+    rank = int(math.ceil(point / 100.0 * len(ordered))) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+class Replay:
+    """Sends requests on schedule from a pool of threads and collects timings.
+
+    Attributes:
+      results: A list of (command, status, latency) for each request;
+        status is None if the request failed outright.
+    """
+
+    def __init__(self, send, connections=16, clock=time.time, sleep=time.sleep):
+        """Create a new Replay.
+
+        Args:
+          send: A function taking (method, url, body, headers) and
+            returning the response's status.  Called from several
+            threads at once.
+          connections: How many threads send requests.
+        """
+        self.send = send
+        self.clock = clock
+        self.sleep = sleep
+        self.results = []
+        self.queue = Queue.Queue()
+        self.threads = [threading.Thread(target=self.work) for _ in range(connections)]
+        for thread in self.threads:
+            thread.setDaemon(True)
+            thread.start()
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            due, command, request = item
+            if due is None:
+                due = self.clock()
+            try:
+                status = self.send(*request)
+            except Exception:
+                status = None
+            self.results.append((command, status, self.clock() - due))
+
+    def run(self, requests, speed=1.0):
+        """Send requests on schedule and wait for all the answers.
+
+        Args:
+          requests: (time, command, request) tuples in time order,
+            where request is as returned by build_request.
+          speed: Replay this many times faster; 0 for flat out,
+            timing each request from when a connection takes it.
+        """
+        started = self.clock()
+        first = None
+        for when, command, request in requests:
+            if first is None:
+                first = when
+            due = None
+            if speed:
+                due = started + (when - first) / speed
+                delay = due - self.clock()
+                if delay > 0:
+                    self.sleep(delay)
+            self.queue.put((due, command, request))
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def report(self):
+        """Summarize the results.
+
+        Returns:
+          A list of dict(command, count, errors, refused, percentiles)
+          for each command and then 'total', where refused counts
+          503s, errors counts other failures and percentiles maps
+          each of PERCENTILES (and 100) to seconds.
+        """
+        by_command = collections.defaultdict(list)
+        for command, status, latency in self.results:
+            by_command[command].append((status, latency))
+            by_command['total'].append((status, latency))
+        report = []
+        for command in sorted(by_command, key=lambda command: (command == 'total', command)):
+            results = by_command[command]
+            latencies = sorted(latency for status, latency in results)
+            report.append(dict(
+                    command=command,
+                    count=len(results),
+                    refused=sum(1 for status, _ in results if status == 503),
+                    errors=sum(1 for status, _ in results
+                               if status is None or (status >= 400 and status != 503)),
+                    percentiles=dict((point, percentile(latencies, point))
+                                     for point in PERCENTILES + (100,))))
+        return report
+
+
+def print_report(report, out=sys.stdout):
+    print >>out, '%-14s %8s %8s %8s' % ('command', 'count', 'refused', 'errors'),
+    print >>out, ' '.join('%9s' % ('p%s' % point) for point in PERCENTILES), '%9s' % 'max'
+    for row in report:
+        print >>out, '%-14s %8d %8d %8d' % (
+            row['command'], row['count'], row['refused'], row['errors']),
+        print >>out, ' '.join('%7.1fms' % (1000 * row['percentiles'][point])
+                              for point in PERCENTILES + (100,))
+
+
+def connection_factory(server, timeout):
+    "Make connections to a host:port or Unix domain socket pathname."
+    if ':' in server:
+        host, port = server.rsplit(':', 1)
+        return lambda: httplib.HTTPConnection(host, int(port), timeout=timeout)
+    return lambda: password_oracle_client.UnixHTTPConnection(server, timeout)
+
+
+def main(argv):
+    try:
+        argv = GFLAGS(argv)  # parse flags
+    except gflags.FlagsError, e:
+        print >>sys.stderr, '%s\nUsage: %s ARGS\n%s' % (e, sys.argv[0], GFLAGS)
+        sys.exit(1)
+    pool = password_oracle_client.ConnectionPool(
+        connection_factory(GFLAGS.server, GFLAGS.timeout), GFLAGS.connections)
+
+    def send(method, url, body=None, headers={}):
+        def request(connection):
+            connection.request(method, url, body, headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        return pool.call(request)
+
+    status, body = send('GET', GFLAGS.prefix + 'hash_range.json')
+    if status != httplib.OK:
+        print >>sys.stderr, 'Fetching hash_range failed with %d' % status
+        sys.exit(1)
+    hash_range = int(json.loads(body))
+    f = GFLAGS.input == '-' and sys.stdin or open(GFLAGS.input, 'rb')
+    requests = ((record.time, record.command, build_request(record, GFLAGS.prefix, hash_range))
+                for record in traffic_log.read_records(f))
+    replay = Replay(lambda *request: send(*request)[0], GFLAGS.connections)
+    replay.run(requests, GFLAGS.speed)
+    print_report(replay.report())
+
+
+if __name__ == "__main__":
+    main(sys.argv)
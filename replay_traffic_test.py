@@ -0,0 +1,89 @@
+#!/usr/bin/env python2.6
+
+from replay_traffic import *
+import StringIO
+import unittest
+
+
+class BuildRequestTest(unittest.TestCase):
+    def record(self, method, command, kind, length=0, fingerprint=0):
+        return traffic_log.Record(0.0, method, command, kind, length, fingerprint)
+
+    def test_get_hash(self):
+        self.assertEquals(build_request(self.record('GET', 'available', traffic_log.HASH,
+                                                    fingerprint=1234), '/', 1000),
+                          ('GET', '/available.json?hash=234', None, {}))
+
+    def test_get_password_keeps_length(self):
+        method, url, body, headers = build_request(
+            self.record('GET', 'entropy', traffic_log.PASSWORD, 20, 0xabc), '/p/', 1000)
+        self.assertEquals(url, '/p/entropy.json?password=0000000000000abc0000')
+
+    def test_post_batch(self):
+        method, url, body, headers = build_request(
+            self.record('POST', 'claim', traffic_log.HASHES, 3, 998), '/', 1000)
+        self.assertEquals((method, url, json.loads(body)),
+                          ('POST', '/claim', dict(hashes=[998, 999, 0])))
+
+    def test_post_without_arguments(self):
+        self.assertEquals(build_request(self.record('POST', 'snapshot', traffic_log.NONE),
+                                        '/', 1000)[:3],
+                          ('POST', '/snapshot', '{}'))
+
+
+class PercentileTest(unittest.TestCase):
+    def test_percentile(self):
+        ordered = range(1, 101)
+        self.assertEquals(percentile(ordered, 50), 50)
+        self.assertEquals(percentile(ordered, 99.9), 100)
+        self.assertEquals(percentile(ordered, 100), 100)
+        self.assertEquals(percentile([7], 50), 7)
+        self.assertEquals(percentile([], 50), None)
+
+
+class ReplayTest(unittest.TestCase):
+    def test_schedule_and_report(self):
+        now = [100.0]
+        slept = []
+
+        def sleep(seconds):
+            slept.append(seconds)
+            now[0] += seconds
+
+        statuses = {'/available.json': 200, '/entropy.json': 503}
+        replay = Replay(lambda method, url, body, headers: statuses[url],
+                        connections=2, clock=lambda: now[0], sleep=sleep)
+        replay.run([(10.0, 'available', ('GET', '/available.json', None, {})),
+                    (12.0, 'entropy', ('GET', '/entropy.json', None, {})),
+                    (16.0, 'available', ('GET', '/available.json', None, {}))],
+                   speed=2)
+        self.assertEquals(slept, [1.0, 2.0])
+        report = dict((row['command'], row) for row in replay.report())
+        self.assertEquals(report['available']['count'], 2)
+        self.assertEquals(report['entropy']['refused'], 1)
+        self.assertEquals(report['total']['count'], 3)
+        self.assertEquals(report['total']['errors'], 0)
+        out = StringIO.StringIO()
+        print_report(replay.report(), out)
+        self.assertEquals(len(out.getvalue().splitlines()), 4)
+
+    def test_flat_out_times_from_send(self):
+        now = [0.0]
+
+        def send(*request):
+            now[0] += 1.0
+            return 200
+        replay = Replay(send, connections=1, clock=lambda: now[0])
+        replay.run([(0.0, 'add', ('POST', '/add', '{}', {}))] * 5, speed=0)
+        self.assertEquals([latency for _, _, latency in replay.results], [1.0] * 5)
+
+    def test_failures_are_errors(self):
+        def send(*request):
+            raise IOError('connection refused')
+        replay = Replay(send, connections=1)
+        replay.run([(0.0, 'add', ('POST', '/add', '{}', {}))], speed=0)
+        self.assertEquals(replay.report()[0]['errors'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python2.6
+
+"""seed_sketch
+
+Replays a log of adds into a fresh deprecating sketch, offline, and
+writes a file password_oracle.py can serve with --bloom_filter.  Use
+it to stand up a new shard, or after a cutover, instead of pushing
+days of adds one at a time through POST add.
+
+With --blocked the result is a BlockedDeprecatingSketch, for a server
+running with --sketch=blocked.
+
+The input has one add per line, oldest first: either a hash= value
+(--format=hash) or a clear text password (--format=password).  The
+sketch takes its shape from --slots, --items and --per_item, which
+must match the server's.
+
+# ./seed_sketch.py --format=hash --output=bloom_filter.pickle < adds.log
+
+The result is exactly what adding each line in turn would produce,
+but only the adds that still fit in the sketch's ring buffer are
+hashed (see DeprecatingSketch.add_many), so the replay runs at the
+speed the log can be read.
+"""
+
+import blocked_sketch
+import cPickle
+import deprecating_sketch
+import gflags
+import itertools
+import os
+import sys
+import time
+
+GFLAGS = gflags.FLAGS
+
+gflags.DEFINE_enum('format', 'hash', ['hash', 'password'],
+                   'Whether each input line is a hash value or a password.')
+gflags.DEFINE_string('input', '-', 'File to replay, - for stdin.')
+gflags.DEFINE_string('output', 'bloom_filter.pickle', 'Sketch file to write.')
+gflags.DEFINE_integer('progress', 1000000, 'Report progress every this many adds.')
+gflags.DEFINE_boolean('blocked', False, 'Write a blocked sketch (see --block) instead.')
+
+
+class Progress:
+    """Counts items on their way past and reports the rate to a file."""
+
+    def __init__(self, every, out=sys.stderr, clock=time.time):
+        self.every = every
+        self.out = out
+        self.clock = clock
+        self.started = clock()
+        self.count = 0
+
+    def rate(self):
+        return self.count / max(self.clock() - self.started, 1e-9)
+
+    def report(self):
+        print >>self.out, "%d adds, %.0f adds/s" % (self.count, self.rate())
+
+    def watch(self, items):
+        "Yield items, reporting after every self.every of them."
+        items = iter(items)
+        for chunk in iter(lambda: list(itertools.islice(items, self.every)), []):
+            for item in chunk:
+                yield item
+            self.count += len(chunk)
+            if len(chunk) == self.every:
+                self.report()
+
+
+def parse_hashes(lines, out=sys.stderr):
+    """Turn hash= lines into integers.
+
+    Blank lines are skipped, and so is any other line that isn't an
+    integer, with its line number reported to out.
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield int(line)
+        except ValueError:
+            print >>out, "Skipping line %d, not a hash: %r" % (number, line)
+
+
+def parse(lines, format, out=sys.stderr):
+    """Turn input lines into what DeprecatingSketch.add takes."""
+    if format == 'hash':
+        return parse_hashes(lines, out)
+    return (line.rstrip('\r\n') for line in lines)
+
+
+def seed(sketch, lines, format='hash', progress=None, out=sys.stderr):
+    """Add every line to sketch, in order.
+
+    Returns:
+      The number of adds replayed.
+    """
+    items = parse(lines, format, out)
+    if progress:
+        items = progress.watch(items)
+    return sketch.add_many(items)
+
+
+def write(sketch, path):
+    "Write sketch to path via a temporary file, as the server does."
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'wb') as f:
+        cPickle.dump(sketch, f, cPickle.HIGHEST_PROTOCOL)
+    os.rename(temporary, path)
+
+
+def main(argv):
+    try:
+        argv = GFLAGS(argv)  # parse flags
+    except gflags.FlagsError, e:
+        print >>sys.stderr, '%s\nUsage: %s ARGS\n%s' % (e, sys.argv[0], GFLAGS)
+        sys.exit(1)
+    if GFLAGS.blocked:
+        sketch = blocked_sketch.BlockedDeprecatingSketch(
+            slots=GFLAGS.slots, items=GFLAGS.items, per_item=GFLAGS.per_item,
+            block=GFLAGS.block, counter_bits=int(GFLAGS.counter_bits))
+    else:
+        sketch = deprecating_sketch.DeprecatingSketch(
+            slots=GFLAGS.slots, items=GFLAGS.items, per_item=GFLAGS.per_item,
+            counter_bits=int(GFLAGS.counter_bits))
+    lines = GFLAGS.input == '-' and sys.stdin or open(GFLAGS.input)
+    progress = Progress(GFLAGS.progress)
+    count = seed(sketch, lines, GFLAGS.format, progress)
+    write(sketch, GFLAGS.output)
+    progress.count = count
+    print >>sys.stderr, "Replayed %d adds in %.1fs (%.0f adds/s)" % (
+        count, time.time() - progress.started, progress.rate())
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python2.6
+
+from seed_sketch import *
+import StringIO
+import unittest
+
+
+class SeedTest(unittest.TestCase):
+    def setUp(self):
+        self.sketch = deprecating_sketch.DeprecatingSketch(slots=100, items=4, per_item=1)
+
+    def test_seed_hashes(self):
+        self.assertEquals(seed(self.sketch, StringIO.StringIO("1\n2\n3\n")), 3)
+        self.assertTrue(2 in self.sketch)
+        self.assertFalse(4 in self.sketch)
+
+    def test_bad_hash_lines_skipped(self):
+        out = StringIO.StringIO()
+        self.assertEquals(seed(self.sketch, StringIO.StringIO("1\n\n2\nx\n 3 \n"), out=out), 3)
+        self.assertTrue(3 in self.sketch)
+        self.assertEquals(out.getvalue(), "Skipping line 4, not a hash: 'x'\n")
+
+    def test_seed_passwords_matches_add(self):
+        expected = deprecating_sketch.DeprecatingSketch(slots=100, items=4, per_item=1)
+        passwords = ["pw%d" % i for i in range(10)]
+        for password in passwords:
+            expected.add(password)
+        seed(self.sketch, StringIO.StringIO("".join(p + "\r\n" for p in passwords)), 'password')
+        self.assertEquals(self.sketch, expected)
+
+    def test_progress(self):
+        out = StringIO.StringIO()
+        progress = Progress(2, out)
+        seed(self.sketch, StringIO.StringIO("1\n2\n3\n4\n5\n"), 'hash', progress)
+        self.assertEquals(progress.count, 5)
+        self.assertEquals(len(out.getvalue().splitlines()), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
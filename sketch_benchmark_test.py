@@ -0,0 +1,21 @@
+#!/usr/bin/env python2.6
+
+from sketch_benchmark import *
+import random
+import unittest
+
+
+class MeasureTest(unittest.TestCase):
+    def test_layouts_compared(self):
+        names = []
+        for name, sketch in layouts(256, 32, 2, 16, 8):
+            fill(sketch, 32, random.Random(1))
+            rate, false_positives, all_set = measure(sketch, 1000, random.Random(2))
+            self.assertTrue(rate > 0)
+            self.assertTrue(0 < all_set <= false_positives < 1)
+            names.append(name)
+        self.assertEquals(names, ['scattered', 'blocked/16'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python2.6
+
+"""sketch_protocol
+
+A compact binary protocol for clients that already send hash values
+(see the NEWS entry for Feb 26th, 2011) and don't want to pay for HTTP
+request-line parsing, header parsing and JSON encoding just to check
+a single integer.
+
+Every request and response is a frame:
+
+  4 bytes   big-endian length of everything that follows
+  1 byte    opcode (requests) or status (responses)
+  ...       payload
+
+Requests:
+
+  CHECK           payload: any number of 8 byte big-endian hashes.
+                  response: one byte per hash, 1 if the hash is
+                  available, 0 if it was used recently.
+
+  ADD             payload: any number of hashes.  Each one is added
+                  to the sketch.  response: empty.
+
+  CHECK_AND_ADD   payload: any number of hashes.  Each hash is tested
+                  and, if available, added while holding the sketch's
+                  lock.  response: one byte per hash with its prior
+                  availability.
+
+  HASH_RANGE      payload: empty.  response: the sketch's hash_range
+                  as a decimal string.
+
+  NAMESPACE       payload: the name of a namespace (see --namespace in
+                  password_oracle.py), or nothing for the default
+                  sketch.  Every later request on this connection is
+                  answered from that namespace's sketch.  response:
+                  empty.
+
+A connection stays open for as long as the client likes, and clients
+may pipeline as many frames as they want without waiting for the
+answers; responses are returned in order.  Because hashes are 64
+bits wide this protocol can only be used with sketches whose
+hash_range fits in 64 bits (the defaults need 38.)
+"""
+
+import SocketServer
+import struct
+
+CHECK = 1
+ADD = 2
+CHECK_AND_ADD = 3
+HASH_RANGE = 4
+NAMESPACE = 5
+
+STATUS_OK = 0
+STATUS_UNKNOWN_OPCODE = 1
+STATUS_BAD_FRAME = 2
+STATUS_HASH_OUT_OF_RANGE = 3
+STATUS_UNKNOWN_NAMESPACE = 4
+
+HEADER = struct.Struct('!IB')
+HASH = struct.Struct('!Q')
+
+MAX_FRAME = 2 ** 20
+RECV_SIZE = 2 ** 16
+
+
+def encode_frame(code, payload=''):
+    """Build a single frame from an opcode or status and its payload."""
+    return HEADER.pack(len(payload) + 1, code) + payload
+
+
+def encode_hashes(hashes):
+    """Pack a sequence of hashes into a request payload."""
+    return struct.pack('!%dQ' % len(hashes), *hashes)
+
+
+def decode_hashes(payload):
+    """Unpack a request payload into a tuple of hashes.
+
+    Raises:
+      ValueError if the payload isn't a whole number of hashes.
+    """
+    if len(payload) % HASH.size:
+        raise ValueError('payload is not a multiple of %d bytes' % HASH.size)
+    return struct.unpack('!%dQ' % (len(payload) // HASH.size), payload)
+
+
+def decode_frames(buffered):
+    """Split as many complete frames as possible off buffered.
+
+    Returns:
+      ([(code, payload), ...], remaining) where remaining is the
+      start of a frame that hasn't completely arrived yet.
+
+    Raises:
+      ValueError if a frame claims to be longer than MAX_FRAME.
+    """
+    frames = []
+    offset = 0
+    while len(buffered) - offset >= HEADER.size:
+        length, code = HEADER.unpack_from(buffered, offset)
+        if length > MAX_FRAME or length < 1:
+            raise ValueError('bad frame length %d' % length)
+        end = offset + 4 + length
+        if end > len(buffered):
+            break
+        frames.append((code, buffered[offset + HEADER.size:end]))
+        offset = end
+    return frames, buffered[offset:]
+
+
+class SketchProtocolHandler(SocketServer.BaseRequestHandler):
+    """Serves the binary protocol on a single connection.
+
+    Everything that arrives in one recv is answered with one sendall,
+    so pipelined requests are answered in batches too.
+    """
+
+    def handle(self):
+        self.namespace = ''
+        buffered = ''
+        while True:
+            chunk = self.request.recv(RECV_SIZE)
+            if not chunk:
+                return
+            try:
+                frames, buffered = decode_frames(buffered + chunk)
+            except ValueError:
+                self.request.sendall(encode_frame(STATUS_BAD_FRAME))
+                return
+            if frames:
+                self.request.sendall(''.join(
+                        self.dispatch(code, payload) for code, payload in frames))
+
+    def dispatch(self, opcode, payload):
+        """Answer a single request frame.
+
+        Returns:
+          The encoded response frame.
+        """
+        if opcode == NAMESPACE:
+            return self.select_namespace(payload)
+        sketch = self.sketch()
+        if opcode == HASH_RANGE:
+            return encode_frame(STATUS_OK, str(sketch.hash_range))
+
+        function = {CHECK: self.check,
+                    ADD: self.add,
+                    CHECK_AND_ADD: self.check_and_add}.get(opcode)
+        if not function:
+            return encode_frame(STATUS_UNKNOWN_OPCODE)
+        try:
+            hashes = decode_hashes(payload)
+        except ValueError:
+            return encode_frame(STATUS_BAD_FRAME)
+        if hashes and max(hashes) >= sketch.hash_range:
+            return encode_frame(STATUS_HASH_OUT_OF_RANGE)
+        return encode_frame(STATUS_OK, function(sketch, hashes))
+
+    def sketch(self):
+        "The sketch of this connection's namespace."
+        if not self.namespace:
+            return self.server.oracle.sketch
+        return self.server.oracle.sketches[self.namespace]
+
+    def select_namespace(self, namespace):
+        if namespace and namespace not in getattr(self.server.oracle, 'sketches', {}):
+            return encode_frame(STATUS_UNKNOWN_NAMESPACE)
+        self.namespace = namespace
+        return encode_frame(STATUS_OK)
+
+    def check(self, sketch, hashes):
+        return ''.join(h in sketch and '\0' or '\1' for h in hashes)
+
+    def add(self, sketch, hashes):
+        with sketch.lock:
+            for h in hashes:
+                sketch.add(h)
+        return ''
+
+    def check_and_add(self, sketch, hashes):
+        return ''.join(claimed and '\1' or '\0' for claimed in sketch.claim_many(hashes))
+
+
+class SketchProtocolServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """Serves the binary protocol for another server's sketch.
+
+    Each connection gets its own thread; the sketch's lock keeps them
+    and the HTTP server from stepping on each other.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, oracle, server_address, handler=SketchProtocolHandler):
+        """Create a new SketchProtocolServer.
+
+        Args:
+          oracle: Any object with a sketch attribute (and optionally
+            a sketches dict of namespaces), normally the
+            PasswordOracleServer.  The attributes are read for every
+            request so sketches can be replaced underneath us.
+          server_address: (host, port) to listen to.
+        """
+        SocketServer.TCPServer.__init__(self, server_address, handler)
+        self.oracle = oracle
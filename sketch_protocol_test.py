@@ -0,0 +1,102 @@
+#!/usr/bin/env python2.6
+
+import deprecating_sketch
+import socket
+import threading
+import unittest
+from sketch_protocol import *
+
+
+class FakeOracle:
+    def __init__(self, sketch, sketches={}):
+        self.sketch = sketch
+        self.sketches = sketches
+
+
+class FramingTest(unittest.TestCase):
+    def test_round_trip(self):
+        frames, remaining = decode_frames(
+            encode_frame(CHECK, encode_hashes([1, 2])) + encode_frame(HASH_RANGE))
+        self.assertEquals(frames, [(CHECK, encode_hashes([1, 2])), (HASH_RANGE, '')])
+        self.assertEquals(remaining, '')
+
+    def test_partial_frame_kept(self):
+        data = encode_frame(ADD, encode_hashes([7]))
+        frames, remaining = decode_frames(data + data[:6])
+        self.assertEquals(frames, [(ADD, encode_hashes([7]))])
+        self.assertEquals(remaining, data[:6])
+
+    def test_oversized_frame(self):
+        self.assertRaises(ValueError, decode_frames, HEADER.pack(MAX_FRAME + 1, ADD))
+
+    def test_decode_hashes(self):
+        self.assertEquals(decode_hashes(encode_hashes([3, 2 ** 40])), (3, 2 ** 40))
+        self.assertRaises(ValueError, decode_hashes, '\0' * 7)
+
+
+class SketchProtocolServerTest(unittest.TestCase):
+    def setUp(self):
+        self.sketch = deprecating_sketch.DeprecatingSketch(slots=100, items=2, per_item=1)
+        self.admin = deprecating_sketch.DeprecatingSketch(slots=10, items=2, per_item=1)
+        self.server = SketchProtocolServer(FakeOracle(self.sketch, dict(admin=self.admin)),
+                                           ('127.0.0.1', 0))
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.connection = socket.create_connection(self.server.server_address)
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request(self, *frames):
+        self.connection.sendall(''.join(frames))
+        responses = []
+        buffered = ''
+        while len(responses) < len(frames):
+            buffered += self.connection.recv(RECV_SIZE)
+            decoded, buffered = decode_frames(buffered)
+            responses.extend(decoded)
+        return responses
+
+    def test_hash_range(self):
+        self.assertEquals(self.request(encode_frame(HASH_RANGE)),
+                          [(STATUS_OK, '100')])
+
+    def test_pipelined_check_add_check(self):
+        self.assertEquals(
+            self.request(encode_frame(CHECK, encode_hashes([5, 6])),
+                         encode_frame(ADD, encode_hashes([5])),
+                         encode_frame(CHECK, encode_hashes([5, 6]))),
+            [(STATUS_OK, '\1\1'), (STATUS_OK, ''), (STATUS_OK, '\0\1')])
+        self.assertTrue(5 in self.sketch)
+
+    def test_check_and_add(self):
+        self.assertEquals(
+            self.request(encode_frame(CHECK_AND_ADD, encode_hashes([9, 9]))),
+            [(STATUS_OK, '\1\0')])
+
+    def test_namespace(self):
+        self.assertEquals(
+            self.request(encode_frame(NAMESPACE, 'admin'),
+                         encode_frame(HASH_RANGE),
+                         encode_frame(ADD, encode_hashes([5])),
+                         encode_frame(NAMESPACE, 'other'),
+                         encode_frame(NAMESPACE),
+                         encode_frame(CHECK, encode_hashes([5]))),
+            [(STATUS_OK, ''), (STATUS_OK, '10'), (STATUS_OK, ''),
+             (STATUS_UNKNOWN_NAMESPACE, ''), (STATUS_OK, ''), (STATUS_OK, '\1')])
+        self.assertTrue(5 in self.admin)
+
+    def test_errors(self):
+        self.assertEquals(
+            self.request(encode_frame(99),
+                         encode_frame(CHECK, '\0\0\0'),
+                         encode_frame(ADD, encode_hashes([100]))),
+            [(STATUS_UNKNOWN_OPCODE, ''), (STATUS_BAD_FRAME, ''),
+             (STATUS_HASH_OUT_OF_RANGE, '')])
+
+
+if __name__ == "__main__":
+    unittest.main()
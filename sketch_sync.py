@@ -0,0 +1,241 @@
+#!/usr/bin/env python2.6
+
+"""sketch_sync
+
+Shares recent adds between password oracles in different places, so
+a password that is popular everywhere but rare at each site still
+gets deprecated.
+
+Every --sync_interval seconds each oracle takes the delta of its own
+adds since last time from every sketch (DeprecatingSketch.export_delta)
+and POSTs it to each --peer:
+
+  POST PREFIX[/NAMESPACE]/merge?origin=NAME   (application/octet-stream)
+
+The receiving sketch adds the delta to its counters and keeps it,
+separately for each origin, until that origin has sent a whole ring
+buffer's worth of increments after it; then it is subtracted again.
+A delta holds at most items * per_item increments however busy the
+site was, and is sent zlib compressed as sorted (slot, count) pairs,
+so the cost per peer is bounded by the sketch's size and the
+interval, not by the number of signups.  All oracles must use the
+same --sketch, slots, items and per_item, and --block for blocked
+sketches; a delta from a sketch of another layout is refused.
+
+A merge is only accepted from an origin named by --accept_origin, so
+each oracle has to list the --origin of every peer sending to it.
+This bounds how many origins a sketch keeps deltas for, but it is not
+access control: origin is just a query parameter, and nothing checks
+who sent it.  Keep merge out of reach of anyone but the peers, e.g. by
+firewalling the port.  A delta of more increments than a ring buffer
+holds, or one that decompresses to more pairs than that, is refused
+before it is decoded in full.
+
+If a peer can't be reached its delta is kept and folded into the next
+one, up to a ring buffer's worth.
+
+Try it with two local processes:
+
+# ./password_oracle.py --port=8001 --bloom_filter=a.pickle \\
+    --origin=a --peer=http://127.0.0.1:8002/ --accept_origin=b &
+# ./password_oracle.py --port=8002 --bloom_filter=b.pickle \\
+    --origin=b --peer=http://127.0.0.1:8001/ --accept_origin=a &
+# curl -d password=123456 127.0.0.1:8001/add
+# sleep 10; curl --get 127.0.0.1:8002/available.json -d password=123456
+false
+"""
+
+import gflags
+import httplib
+import socket
+import struct
+import sys
+import threading
+import time
+import urllib
+import urlparse
+import zlib
+
+GFLAGS = gflags.FLAGS
+
+gflags.DEFINE_multistring('peer', [],
+                          'URL (http://host:port/path/) of another oracle to share '
+                          'adds with.  May be repeated.')
+gflags.DEFINE_string('origin', None,
+                     'The name this oracle gives its peers.  Defaults to host:port.')
+gflags.DEFINE_multistring('accept_origin', [],
+                          'The --origin of a peer whose deltas are merged.  May be '
+                          'repeated; deltas naming any other origin are refused.  '
+                          'Origins are not authenticated.')
+gflags.DEFINE_integer('sync_interval', 10, 'Seconds between sending deltas to peers.')
+
+# slots, ring_size and block, which is 0 for a scattered sketch.
+HEADER = struct.Struct('!III')
+PAIR = struct.Struct('!II')
+
+
+class SyncError(Exception):
+    "Raised when a peer refuses a delta."
+
+
+def layout(sketch):
+    """Describe where a sketch puts a password's slots.
+
+    Returns:
+      (slots, ring_size, block), block being 0 unless the sketch is a
+      BlockedDeprecatingSketch.
+    """
+    return sketch.slotlen, sketch.ring_size, getattr(sketch, 'block', 0)
+
+
+def encode_delta(delta, slots, ring_size, block=0):
+    """Encode a delta for the wire.
+
+    Args:
+      delta: A dict from DeprecatingSketch.export_delta.
+      slots, ring_size, block: The layout of the sketch it came from.
+    """
+    pairs = sorted(delta.iteritems())
+    return HEADER.pack(slots, ring_size, block) + zlib.compress(
+        struct.pack('!%dI' % (2 * len(pairs)), *[n for pair in pairs for n in pair]))
+
+
+def max_delta_size(ring_size):
+    "The most bytes encode_delta can produce for a sketch of ring_size."
+    body = ring_size * PAIR.size
+    # zlib's worst case for incompressible data, with room to spare.
+    return HEADER.size + body + body // 1000 + 64
+
+
+def decode_delta(data, max_pairs=None):
+    """Decode a delta encoded by encode_delta.
+
+    Args:
+      data: The encoded delta.
+      max_pairs: The most (slot, count) pairs to accept, by default
+        the ring_size in its header.  Decompression stops there, so a
+        small delta can't expand into a huge one.
+
+    Returns:
+      (slots, ring_size, block, delta)
+
+    Raises:
+      ValueError if data isn't a well formed delta, or has too many
+      pairs.
+    """
+    if len(data) < HEADER.size:
+        raise ValueError('delta too short')
+    slots, ring_size, block = HEADER.unpack_from(data)
+    if max_pairs is None:
+        max_pairs = ring_size
+    limit = max_pairs * PAIR.size
+    decompressor = zlib.decompressobj()
+    try:
+        body = decompressor.decompress(data[HEADER.size:], limit + 1)
+    except zlib.error, e:
+        raise ValueError(str(e))
+    if len(body) > limit or decompressor.unconsumed_tail:
+        raise ValueError('delta of more than %d pairs' % max_pairs)
+    if len(body) % PAIR.size:
+        raise ValueError('delta is not a whole number of pairs')
+    numbers = struct.unpack('!%dI' % (len(body) // 4), body)
+    return slots, ring_size, block, dict(zip(numbers[::2], numbers[1::2]))
+
+
+def merge(sketch, origin, data):
+    """Merge an encoded delta from origin into sketch.
+
+    Raises:
+      ValueError if data is malformed or from a sketch of another
+      shape or layout.
+    """
+    slots, ring_size, block, delta = decode_delta(data, sketch.ring_size)
+    if (slots, ring_size, block) != layout(sketch):
+        raise ValueError('delta from a sketch with %d slots, a ring of %d and '
+                         'blocks of %d' % (slots, ring_size, block))
+    if delta and max(delta) >= slots:
+        raise ValueError('slot out of range')
+    sketch.merge(origin, delta)
+
+
+def combine(older, newer, ring_size):
+    """Fold a delta that couldn't be sent into the next one.
+
+    Increments beyond a ring buffer's worth would have expired at the
+    peer anyway, so if the two add up to more than that only the
+    newer one is kept.
+    """
+    if sum(older.itervalues()) + sum(newer.itervalues()) > ring_size:
+        return newer
+    combined = dict(older)
+    for offset, count in newer.iteritems():
+        combined[offset] = combined.get(offset, 0) + count
+    return combined
+
+
+def push(peer, namespace, origin, data, timeout):
+    "POST an encoded delta to a peer's merge command."
+    scheme, netloc, path, _, _, _ = urlparse.urlparse(peer)
+    if not path.endswith('/'):
+        path += '/'
+    if namespace:
+        path += namespace + '/'
+    connection = httplib.HTTPConnection(netloc, timeout=timeout)
+    try:
+        connection.request('POST', '%smerge?%s' % (path, urllib.urlencode(dict(origin=origin))),
+                           data, {'Content-Type': 'application/octet-stream'})
+        response = connection.getresponse()
+        response.read()
+    finally:
+        connection.close()
+    if response.status >= 300:
+        raise SyncError('%s refused the delta with %d' % (peer, response.status))
+
+
+class PeerSync(threading.Thread):
+    """Sends every sketch's delta to every peer on a schedule."""
+
+    def __init__(self, oracle, peers, origin, interval=10, timeout=5.0):
+        """Create a new PeerSync.  Call start() to begin syncing.
+
+        Args:
+          oracle: The PasswordOracleServer whose sketches are shared.
+          peers: URLs of the other oracles.
+          origin: This oracle's name, as its peers know it.
+          interval: Seconds between syncs.
+          timeout: Seconds to wait for a peer.
+        """
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.oracle = oracle
+        self.peers = peers
+        self.origin = origin
+        self.interval = interval
+        self.timeout = timeout
+        self.backlog = {}
+        self.failures = 0
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.sync()
+
+    def sync(self):
+        "Export every sketch's delta and send it to every peer."
+        for namespace, sketch in self.oracle.sketches.items():
+            if not hasattr(sketch, 'export_delta'):
+                continue
+            delta = sketch.export_delta()
+            for peer in self.peers:
+                pending = combine(self.backlog.pop((peer, namespace), {}), delta,
+                                  sketch.ring_size)
+                if not pending:
+                    continue
+                try:
+                    push(peer, namespace, self.origin,
+                         encode_delta(pending, *layout(sketch)),
+                         self.timeout)
+                except (socket.error, httplib.HTTPException, SyncError), e:
+                    print >>sys.stderr, "Sync with %s failed: %s" % (peer, e)
+                    self.failures += 1
+                    self.backlog[(peer, namespace)] = pending
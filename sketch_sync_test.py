@@ -0,0 +1,154 @@
+#!/usr/bin/env python2.6
+
+import blocked_sketch
+import deprecating_sketch
+import generational_sketch
+import password_oracle
+import threading
+import unittest
+from sketch_sync import *
+
+
+class EncodingTest(unittest.TestCase):
+    def test_round_trip(self):
+        delta = {0: 1, 99: 3, 12: 1}
+        self.assertEquals(decode_delta(encode_delta(delta, 100, 8)), (100, 8, 0, delta))
+        self.assertEquals(decode_delta(encode_delta({}, 100, 8, 10)), (100, 8, 10, {}))
+
+    def test_compact(self):
+        delta = dict((offset, 1) for offset in range(0, 2 ** 16, 4))
+        self.assertTrue(len(encode_delta(delta, 2 ** 19, 2 ** 17)) < 4 * len(delta))
+
+    def test_malformed(self):
+        self.assertRaises(ValueError, decode_delta, '\0' * 8)
+        self.assertRaises(ValueError, decode_delta, '\0' * 12 + 'not zlib')
+        self.assertRaises(ValueError, decode_delta, '\0' * 12 + zlib.compress('abc'))
+
+    def test_decompression_is_bounded(self):
+        bomb = HEADER.pack(100, 8, 0) + zlib.compress('\0' * 2 ** 20)
+        self.assertTrue(len(bomb) < 2000)
+        self.assertRaises(ValueError, decode_delta, bomb)
+        self.assertRaises(ValueError, decode_delta, encode_delta({1: 1, 2: 1, 3: 1}, 100, 8), 2)
+        self.assertEquals(decode_delta(encode_delta({1: 1, 2: 1}, 100, 8), 2)[3], {1: 1, 2: 1})
+        sketch = deprecating_sketch.DeprecatingSketch(slots=100, items=4, per_item=2)
+        self.assertRaises(ValueError, merge, sketch, 'peer',
+                          encode_delta(dict((h, 1) for h in range(9)), 100, 2 ** 20))
+
+    def test_max_delta_size(self):
+        delta = dict((h, 2 ** 31) for h in range(0, 2 ** 20, 2 ** 7))
+        self.assertTrue(len(encode_delta(delta, 2 ** 20, len(delta))) <=
+                        max_delta_size(len(delta)))
+
+    def test_merge_checks_geometry(self):
+        sketch = deprecating_sketch.DeprecatingSketch(slots=100, items=4, per_item=2)
+        merge(sketch, 'peer', encode_delta({3: 1}, 100, 8))
+        self.assertTrue(3 in sketch)
+        self.assertRaises(ValueError, merge, sketch, 'peer', encode_delta({3: 1}, 200, 8))
+        self.assertRaises(ValueError, merge, sketch, 'peer', encode_delta({3: 1}, 100, 4))
+        self.assertRaises(ValueError, merge, sketch, 'peer', encode_delta({100: 1}, 100, 8))
+
+    def test_merge_checks_layout(self):
+        scattered = deprecating_sketch.DeprecatingSketch(slots=100, items=4, per_item=2)
+        blocked = blocked_sketch.BlockedDeprecatingSketch(slots=100, items=4, per_item=2,
+                                                          block=10)
+        self.assertEquals(layout(blocked), (100, 8, 10))
+        self.assertRaises(ValueError, merge, scattered, 'peer',
+                          encode_delta({3: 1}, *layout(blocked)))
+        self.assertRaises(ValueError, merge, blocked, 'peer',
+                          encode_delta({3: 1}, *layout(scattered)))
+        self.assertRaises(ValueError, merge, blocked, 'peer', encode_delta({3: 1}, 100, 8, 20))
+        merge(blocked, 'peer', encode_delta({3: 1}, 100, 8, 10))
+        self.assertEquals(blocked.peers.keys(), ['peer'])
+
+    def test_combine(self):
+        self.assertEquals(combine({1: 1}, {1: 1, 2: 1}, 8), {1: 2, 2: 1})
+        self.assertEquals(combine({1: 5}, {2: 4}, 8), {2: 4})
+
+
+class QuietHandler(password_oracle.PasswordOracleRequestHandler):
+    def path_prefix(self):
+        return '/'
+
+    def log_message(self, *args):
+        pass
+
+
+class PeerSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+        self.threads = []
+        self.running = True
+        for _ in range(2):
+            server = password_oracle.PasswordOracleServer(
+                None, None, ('127.0.0.1', 0), QuietHandler)
+            server.sketch = server.sketches[''] = deprecating_sketch.DeprecatingSketch(
+                slots=1000, items=4, per_item=2)
+            server.sketches['admin'] = deprecating_sketch.DeprecatingSketch(
+                slots=100, items=2, per_item=1)
+            server.accepted_origins = frozenset(['a', 'b'])
+            self.servers.append(server)
+            thread = threading.Thread(target=self.serve, args=(server,))
+            thread.start()
+            self.threads.append(thread)
+        self.a, self.b = self.servers
+
+    def serve(self, server):
+        while self.running:
+            server.handle_requests(0.05)
+
+    def tearDown(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        for server in self.servers:
+            server.server_close()
+
+    def url(self, server):
+        return 'http://%s:%d/' % server.server_address
+
+    def test_sync(self):
+        sync = PeerSync(self.a, [self.url(self.b)], 'a')
+        self.a.sketch.add('123456')
+        self.a.sketches['admin'].add(7)
+        self.assertFalse('123456' in self.b.sketch)
+        sync.sync()
+        self.assertTrue('123456' in self.b.sketch)
+        self.assertTrue(7 in self.b.sketches['admin'])
+        self.assertEquals(self.b.sketch.peers.keys(), ['a'])
+        self.assertEquals(sync.failures, 0)
+
+    def test_unknown_origin_refused(self):
+        sync = PeerSync(self.a, [self.url(self.b)], 'mallory')
+        self.a.sketch.add('123456')
+        sync.sync()
+        self.assertFalse('123456' in self.b.sketch)
+        self.assertEquals(self.b.sketch.peers, {})
+        self.assertEquals(sync.failures, 1)
+
+    def test_oversized_delta_refused(self):
+        ring_size = self.b.sketch.ring_size
+        self.assertRaises(SyncError, push, self.url(self.b), '', 'a',
+                          encode_delta({3: ring_size + 1}, 1000, ring_size), 5.0)
+        self.assertFalse(3 in self.b.sketch)
+
+    def test_oversized_body_refused(self):
+        data = encode_delta({3: 1}, 1000, 8) + '\0' * max_delta_size(8)
+        self.assertRaises(SyncError, push, self.url(self.b), '', 'a', data, 5.0)
+        self.assertFalse(3 in self.b.sketch)
+
+    def test_generational_sketches_skipped(self):
+        self.a.sketches['admin'] = generational_sketch.GenerationalSketch(slots=100, per_item=1)
+        PeerSync(self.a, [self.url(self.b)], 'a').sync()
+
+    def test_unreachable_peer_backlogged(self):
+        self.b.sketches['admin'] = deprecating_sketch.DeprecatingSketch(
+            slots=200, items=2, per_item=1)
+        sync = PeerSync(self.a, [self.url(self.b)], 'a')
+        self.a.sketches['admin'].add(7)
+        sync.sync()
+        self.assertEquals(sync.failures, 1)
+        self.assertEquals(sync.backlog, {(self.url(self.b), 'admin'): {7: 1}})
+
+
+if __name__ == "__main__":
+    unittest.main()
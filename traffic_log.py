@@ -0,0 +1,153 @@
+#!/usr/bin/env python2.6
+
+"""traffic_log
+
+A compact binary log of the requests a password oracle answers, so
+that production-shaped load can be replayed against a test server
+with replay_traffic.py.
+
+Capturing is opt-in (--capture on password_oracle.py.)  No password
+or hash value is ever written.  Each is replaced by a 64 bit
+fingerprint: HMAC-SHA256 under a key made up when the log is opened
+and never stored.  Within one log the same password always has the
+same fingerprint, so repeats and bursts of a popular password survive,
+but the log can't be checked against a dictionary.  Passwords also
+keep their length, since that is what scoring them costs.  A server
+restarted onto the same log starts a new key.
+
+Every record is RECORD.size bytes:
+
+  8 bytes   double, the time the request arrived
+  1 byte    method, an index into METHODS
+  1 byte    command, an index into COMMANDS
+  1 byte    argument kind: NONE, PASSWORD, HASH, PASSWORDS or HASHES
+  2 bytes   the password's length, or the number in a batch
+  8 bytes   the fingerprint of the (first) password or hash
+"""
+
+import collections
+import hashlib
+import hmac
+import os
+import struct
+import threading
+import time
+
+RECORD = struct.Struct('!dBBBHQ')
+
+METHODS = ('GET', 'POST')
+COMMANDS = ('available', 'entropy', 'all', 'strong_enough', 'hash_range',
+            'snapshot', 'admission', 'add', 'claim')
+
+NONE = 0
+PASSWORD = 1
+HASH = 2
+PASSWORDS = 3
+HASHES = 4
+
+Record = collections.namedtuple('Record', 'time method command kind length fingerprint')
+
+
+def describe(arguments):
+    """Pick out what a log record keeps of a request's arguments.
+
+    Args:
+      arguments: The decoded query or POST body of a request.
+
+    Returns:
+      (kind, length, value) where value is the password or hash to
+      fingerprint, or None.
+    """
+    for kind, name in ((PASSWORDS, 'passwords'), (HASHES, 'hashes')):
+        values = arguments.get(name)
+        if isinstance(values, list):
+            value = values and values[0] or None
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            return kind, min(len(values), 0xffff), value
+    password = arguments.get('password')
+    if password:
+        if isinstance(password, unicode):
+            password = password.encode('utf-8')
+        return PASSWORD, min(len(password), 0xffff), password
+    if arguments.get('hash'):
+        return HASH, 0, arguments['hash']
+    return NONE, 0, None
+
+
+class TrafficLog:
+    """Appends request records to a file.
+
+    Records are buffered; call flush, or flush_if_due regularly, to
+    push them out.  Safe to share between serving threads.
+    """
+
+    def __init__(self, f, key=None, flush_interval=1.0, clock=time.time):
+        """Create a new TrafficLog.
+
+        Args:
+          f: A file opened for binary writing, preferably appending.
+          key: The fingerprint key.  Random unless given (for tests.)
+          flush_interval: Seconds flush_if_due lets records wait.
+        """
+        self.f = f
+        self.key = key or os.urandom(32)
+        self.lock = threading.Lock()
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.flushed = clock()
+
+    def fingerprint(self, value):
+        "A 64 bit keyed fingerprint of a password or hash."
+        if value is None:
+            return 0
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        digest = hmac.new(self.key, str(value), hashlib.sha256).digest()
+        return struct.unpack('!Q', digest[:8])[0]
+
+    def record(self, method, command, arguments, when):
+        """Log one request.
+
+        Args:
+          method: 'GET' or 'POST'.
+          command: One of COMMANDS; anything else isn't logged.
+          arguments: The decoded query or POST body, see describe.
+          when: The time the request arrived.
+        """
+        if method not in METHODS or command not in COMMANDS:
+            return
+        kind, length, value = describe(arguments)
+        data = RECORD.pack(when, METHODS.index(method), COMMANDS.index(command),
+                           kind, length, self.fingerprint(value))
+        with self.lock:
+            self.f.write(data)
+
+    def flush(self):
+        with self.lock:
+            self.f.flush()
+            self.flushed = self.clock()
+
+    def flush_if_due(self):
+        "Flush if the last flush was at least flush_interval ago."
+        if self.clock() - self.flushed >= self.flush_interval:
+            self.flush()
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+
+def read_records(f):
+    """Read a traffic log.
+
+    Yields:
+      A Record for each request, with method and command as strings.
+      A partly written record at the end is ignored.
+    """
+    while True:
+        data = f.read(RECORD.size)
+        if len(data) < RECORD.size:
+            return
+        when, method, command, kind, length, fingerprint = RECORD.unpack(data)
+        yield Record(when, METHODS[method], COMMANDS[command], kind, length, fingerprint)
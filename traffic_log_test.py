@@ -0,0 +1,67 @@
+#!/usr/bin/env python2.6
+
+from traffic_log import *
+import StringIO
+import unittest
+
+
+class DescribeTest(unittest.TestCase):
+    def test_describe(self):
+        self.assertEquals(describe({}), (NONE, 0, None))
+        self.assertEquals(describe(dict(password='secret')), (PASSWORD, 6, 'secret'))
+        self.assertEquals(describe(dict(password=u'caf\xe9')), (PASSWORD, 5, 'caf\xc3\xa9'))
+        self.assertEquals(describe(dict(hash='37')), (HASH, 0, '37'))
+        self.assertEquals(describe(dict(hashes=[1, 2])), (HASHES, 2, 1))
+        self.assertEquals(describe(dict(passwords=[])), (PASSWORDS, 0, None))
+        self.assertEquals(describe(dict(passwords=[u'p\xe4ss', u'x'])),
+                          (PASSWORDS, 2, 'p\xc3\xa4ss'))
+
+
+class TrafficLogTest(unittest.TestCase):
+    def setUp(self):
+        self.f = StringIO.StringIO()
+        self.log = TrafficLog(self.f)
+
+    def records(self):
+        return list(read_records(StringIO.StringIO(self.f.getvalue())))
+
+    def test_round_trip(self):
+        self.log.record('GET', 'available', dict(hash='37'), 100.5)
+        self.log.record('POST', 'add', dict(password='secret'), 101.0)
+        self.log.record('GET', 'nonsense', {}, 102.0)
+        self.assertEquals(self.records(), [
+                Record(100.5, 'GET', 'available', HASH, 0, self.log.fingerprint('37')),
+                Record(101.0, 'POST', 'add', PASSWORD, 6, self.log.fingerprint('secret'))])
+        self.assertEquals(len(self.f.getvalue()), 2 * RECORD.size)
+
+    def test_fingerprints(self):
+        self.assertEquals(self.log.fingerprint('secret'), self.log.fingerprint('secret'))
+        self.assertNotEquals(self.log.fingerprint('secret'), self.log.fingerprint('Secret'))
+        self.assertEquals(self.log.fingerprint(37), self.log.fingerprint('37'))
+        self.assertNotEquals(TrafficLog(self.f).fingerprint('secret'),
+                             self.log.fingerprint('secret'))
+
+    def test_unicode_fingerprint(self):
+        self.assertEquals(self.log.fingerprint(u'p\xe4ss'), self.log.fingerprint('p\xc3\xa4ss'))
+        self.log.record('POST', 'claim', dict(passwords=[u'p\xe4ss', u'x']), 1.0)
+        self.assertEquals(len(self.records()), 1)
+
+    def test_flush_if_due(self):
+        now = [0.0]
+        flushes = []
+        self.f.flush = lambda: flushes.append(now[0])
+        log = TrafficLog(self.f, flush_interval=1.0, clock=lambda: now[0])
+        log.flush_if_due()
+        now[0] = 1.5
+        log.flush_if_due()
+        log.flush_if_due()
+        self.assertEquals(flushes, [1.5])
+
+    def test_partial_record_ignored(self):
+        self.log.record('GET', 'all', dict(password='secret'), 1.0)
+        self.f.write('\0' * 5)
+        self.assertEquals(len(self.records()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,12 @@
 #!/usr/bin/env python2.6 
 
+import errno
+import os
+import socket
+import stat
+import sys
+import SocketServer
+
 
 class Identity:
     """A mixin class that provides custom hashing and comparison
@@ -73,3 +80,97 @@ def prefixed(s, prefix):
       False is s does not start with prefix, s with the prefix removed otherwise
     """
     return s.startswith(prefix) and s[len(prefix):]
+
+
+class UnixStreamServerMixin:
+    """A mixin that moves a SocketServer.TCPServer onto a Unix domain socket.
+
+    server_address is the pathname of the socket.  A stale socket
+    left behind by a previous run is removed before binding, but one
+    that is still accepting connections is left alone and binding
+    fails with EADDRINUSE.  The socket is removed again by
+    server_close.  Who may connect is decided by the permissions of
+    the socket file.
+
+    The listen backlog is SOMAXCONN rather than SocketServer's 5: a
+    connect with a timeout to a Unix domain socket with a full backlog
+    fails at once with EAGAIN instead of waiting.
+
+    Example:
+
+    class UnixHTTPServer(UnixStreamServerMixin, BaseHTTPServer.HTTPServer):
+      pass
+    """
+
+    address_family = socket.AF_UNIX
+    request_queue_size = socket.SOMAXCONN
+    bound = False
+
+    def server_bind(self):
+        try:
+            if stat.S_ISSOCK(os.stat(self.server_address).st_mode):
+                if self.in_use():
+                    raise socket.error(errno.EADDRINUSE, '%s is in use' % self.server_address)
+                os.unlink(self.server_address)
+        except OSError:
+            pass
+        SocketServer.TCPServer.server_bind(self)
+        self.bound = True
+        # BaseHTTPServer.HTTPServer wants these for its environment.
+        self.server_name = self.server_address
+        self.server_port = 0
+
+    def in_use(self):
+        "Returns True if something is accepting connections on server_address."
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(self.server_address)
+        except socket.error:
+            return False
+        finally:
+            probe.close()
+        return True
+
+    def get_request(self):
+        # Unix domain socket peers are anonymous; report the socket
+        # itself as a (host, port) pair so request logging still works.
+        request, _ = self.socket.accept()
+        return request, (self.server_address, 0)
+
+    def server_close(self):
+        SocketServer.TCPServer.server_close(self)
+        if not self.bound:
+            return
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def deep_sizeof(obj, seen=None):
+    """Estimate the memory used by obj and everything it refers to.
+
+    Follows dicts, lists, tuples and the __slots__ or __dict__ of
+    objects; shared objects are only counted once.
+
+    Returns:
+      The size in bytes, as reported by sys.getsizeof.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    for cls in type(obj).__mro__:
+        for name in cls.__dict__.get('__slots__', ()):
+            size += deep_sizeof(getattr(obj, name, None), seen)
+    if hasattr(obj, '__dict__'):
+        size += deep_sizeof(obj.__dict__, seen)
+    return size
@@ -1,5 +1,8 @@
 #!/usr/bin/env python2.6 
 
+import os
+import shutil
+import tempfile
 import unittest
 from utils import * 
 
@@ -31,6 +34,78 @@ class SegmentationTest(unittest.TestCase):
         actual = list(segment("s", 2))
         self.assertEqual(expected, actual)
 
+class DeepSizeofTest(unittest.TestCase):
+    def test_counts_contents(self):
+        self.assertTrue(deep_sizeof({'a': 'x' * 1000}) > 1000)
+
+    def test_shared_objects_counted_once(self):
+        shared = 'x' * 1000
+        self.assertTrue(deep_sizeof([shared, shared]) < 2000)
+
+    def test_inherited_slots(self):
+        class Base(object):
+            __slots__ = ('data',)
+        class Derived(Base):
+            __slots__ = ()
+        derived = Derived()
+        derived.data = 'x' * 1000
+        self.assertTrue(deep_sizeof(derived) > 1000)
+
+class EchoHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(self.rfile.readline())
+
+class UnixEchoServer(UnixStreamServerMixin, SocketServer.TCPServer):
+    pass
+
+class UnixStreamServerMixinTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'socket')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_serves_and_cleans_up(self):
+        server = UnixEchoServer(self.path, EchoHandler)
+        client = socket.socket(socket.AF_UNIX)
+        client.connect(self.path)
+        client.sendall('hello\n')
+        server.handle_request()
+        self.assertEquals(client.recv(100), 'hello\n')
+        client.close()
+        server.server_close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_replaces_stale_socket(self):
+        stale = socket.socket(socket.AF_UNIX)
+        stale.bind(self.path)
+        stale.close()
+        UnixEchoServer(self.path, EchoHandler).server_close()
+
+    def test_keeps_live_socket(self):
+        server = UnixEchoServer(self.path, EchoHandler)
+        try:
+            self.assertRaises(socket.error, UnixEchoServer, self.path, EchoHandler)
+            self.assertTrue(os.path.exists(self.path))
+            self.assertTrue(server.in_use())
+        finally:
+            server.server_close()
+
+    def test_backlog(self):
+        server = UnixEchoServer(self.path, EchoHandler)
+        clients = []
+        try:
+            for _ in range(32):
+                client = socket.socket(socket.AF_UNIX)
+                client.settimeout(1.0)
+                client.connect(self.path)
+                clients.append(client)
+        finally:
+            for client in clients:
+                client.close()
+            server.server_close()
+
 if __name__ == "__main__":
     unittest.main()
 